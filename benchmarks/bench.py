@@ -0,0 +1,333 @@
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+
+from package.compiler import Compiler, IncrementalCompiler
+from package.debug import Debugger
+from package.editor import Buffer, Cursor
+from package.engine import create_engine
+from package.mpu import CPU
+from package.render import Renderer
+from package.trace import Tracer
+
+PROGRAMS = {
+    'count': """
+        MOVLA 00
+        MOVLB 01
+        ADDA
+        JMPL 04
+    """,
+    'fibonacci': """
+        MOVLA 00
+        MOVLB 01
+        OUTA
+        ADDB
+        JCFL 00
+        OUTB
+        ADDA
+        JCFL 00
+        JMPL 04
+    """,
+    # Copies C0-CF to D0-DF by rewriting the operands of its first two
+    # instructions, then starts over.
+    'memcopy': """
+        MOVRA C0
+        MOVAR D0
+        MOVRA 01
+        MOVLB 01
+        ADDA
+        MOVAR 01
+        MOVRA 03
+        ADDA
+        MOVAR 03
+        MOVLB E0
+        SUBBA
+        JZFL 17
+        JMPL 00
+        MOVLA C0
+        MOVAR 01
+        MOVLA D0
+        MOVAR 03
+        JMPL 00
+    """,
+    # Increments the operand of its own OUTL on every pass.
+    'selfmodify': """
+        MOVRA 08
+        MOVLB 01
+        ADDA
+        MOVAR 08
+        OUTL 00
+        JMPL 00
+    """,
+}
+
+ENGINES = ['interp', 'dispatch', 'block']
+
+BENCHMARKS = {}
+
+
+def benchmark(name: str, unit: str):
+    def register(function):
+        BENCHMARKS[name] = (function, unit)
+        return function
+    return register
+
+
+def measure(function, min_time: float):
+    """Calls function until min_time passed, returning work per second."""
+    work = 0
+    start = time.perf_counter()
+    while True:
+        work += function()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            return work / elapsed
+
+
+def cpu_benchmark(program: str, engine: str, traced: bool = False,
+                  debugger: Debugger = None):
+    def run(min_time: float):
+        image, _ = Compiler(PROGRAMS[program].split()).compile()
+        cpu = CPU()
+        cpu.set_instructions(image)
+        cpu.set_enabled(True)
+        cpu.debugger = debugger
+        if traced:
+            cpu.tracer = Tracer(os.devnull)
+        runner = create_engine(cpu, engine)
+        batch = 2000 if engine == 'interp' else 100000
+        try:
+            return measure(lambda: runner.run(batch), min_time)
+        finally:
+            if traced:
+                cpu.tracer.close()
+    return run
+
+
+for _program in PROGRAMS:
+    for _engine in ENGINES:
+        benchmark('cpu.' + _program + '.' + _engine, 'instructions/s')(
+            cpu_benchmark(_program, _engine))
+benchmark('cpu.memcopy.dispatch.traced', 'instructions/s')(
+    cpu_benchmark('memcopy', 'dispatch', True))
+
+
+def unreached_debugger(watch: bool):
+    """Breakpoints, and optionally watchpoints, the memcopy program
+    never reaches."""
+    debugger = Debugger()
+    for address in range(0x20, 0xC0):
+        debugger.add(format(address, '02X'))
+        if watch:
+            debugger.watch(address)
+    return debugger
+
+
+benchmark('cpu.memcopy.dispatch.breakpoints', 'instructions/s')(
+    cpu_benchmark('memcopy', 'dispatch', debugger=unreached_debugger(False)))
+benchmark('cpu.memcopy.dispatch.watchpoints', 'instructions/s')(
+    cpu_benchmark('memcopy', 'dispatch', debugger=unreached_debugger(True)))
+
+
+def generate_source(lines: int, seed: int = 0):
+    rnd = random.Random(seed)
+    names = ['MOVLA', 'MOVLB', 'ADDA', 'SUBBA', 'OUTA', 'MOVAR', 'JZFL']
+    out = []
+    for _ in range(lines):
+        name = rnd.choice(names)
+        if name in ('ADDA', 'SUBBA', 'OUTA'):
+            out.append(name)
+        else:
+            out.append(name + " " + format(rnd.randrange(256), '02X'))
+    return "\n".join(out)
+
+
+@benchmark('compiler.compile', 'tokens/s')
+def compiler_compile(min_time: float):
+    tokens = generate_source(20000).split()
+
+    def run():
+        Compiler(tokens).compile()
+        return len(tokens)
+    return measure(run, min_time)
+
+
+@benchmark('compiler.optimize', 'tokens/s')
+def compiler_optimize(min_time: float):
+    tokens = generate_source(20000).split()
+
+    def run():
+        Compiler(tokens, 16, 8, optimize=True).compile()
+        return len(tokens)
+    return measure(run, min_time)
+
+
+@benchmark('compiler.incremental_edit', 'edits/s')
+def compiler_incremental_edit(min_time: float):
+    lines = generate_source(20000).splitlines()
+    assembler = IncrementalCompiler(16, 8)
+    assembler.update(lines)
+    middle = len(lines) // 2
+    texts = ['OUTA', 'ADDA']
+
+    def run():
+        assembler.replace(middle, 1, texts[:1])
+        texts.reverse()
+        return 1
+    return measure(run, min_time)
+
+
+@benchmark('editor.type', 'keys/s')
+def editor_type(min_time: float):
+    buffer = Buffer(generate_source(5000).splitlines())
+    cursor = Cursor(2500, 0)
+
+    def run():
+        # One line typed and joined back in the middle of the buffer.
+        for c in "MOVLA 01":
+            buffer.insert(cursor, c)
+            cursor.col += 1
+        buffer.split(cursor)
+        buffer.delete(cursor)
+        for _ in range(8):
+            cursor.col -= 1
+            buffer.delete(cursor)
+        return 18
+    return measure(run, min_time)
+
+
+@benchmark('editor.export', 'lines/s')
+def editor_export(min_time: float):
+    buffer = Buffer(generate_source(5000).splitlines())
+
+    def run():
+        buffer.text()
+        return len(buffer)
+    return measure(run, min_time)
+
+
+@benchmark('ram.get_mem_list', 'calls/s')
+def ram_get_mem_list(min_time: float):
+    ram = CPU().ram_mem
+
+    def run():
+        ram.get_mem_list()
+        return 1
+    return measure(run, min_time)
+
+
+class NullWindow:
+    """Stands in for a curses window, counting the cells written."""
+
+    def __init__(self, height: int, width: int):
+        self.size = (height, width)
+        self.writes = 0
+
+    def getmaxyx(self):
+        return self.size
+
+    def box(self, *args):
+        self.writes += 1
+
+    def addstr(self, *args):
+        self.writes += 1
+
+    def noutrefresh(self):
+        pass
+
+
+def render_benchmark(changes: int, machine: str = 'mpu8'):
+    def run(min_time: float):
+        renderer = Renderer()
+        window = NullWindow(18, 49)
+        cpu = CPU.from_profile(machine)
+        size = cpu.ram_mem.addressMaxValue + 1
+        mem = cpu.ram_mem.page(0, renderer.page_size)
+        renderer.ram(window, mem, 0)
+        rnd = random.Random(0)
+
+        def frame():
+            for _ in range(changes):
+                cpu.ram_mem.write(rnd.randrange(size), rnd.randrange(256))
+            renderer.ram(window, mem, cpu.pc.get_counter())
+            renderer.text(window, format(cpu.reg_a.get_value(), '02X'))
+            return 1
+        return measure(frame, min_time)
+    return run
+
+
+benchmark('render.frame.idle', 'frames/s')(render_benchmark(0))
+benchmark('render.frame.one_write', 'frames/s')(render_benchmark(1))
+benchmark('render.frame.all_ram', 'frames/s')(render_benchmark(256))
+benchmark('render.frame.wide8_page', 'frames/s')(
+    render_benchmark(256, 'wide8'))
+
+
+def compare(results: dict, baseline: dict, threshold: float):
+    """Lists benchmarks that got more than threshold slower."""
+    regressions = []
+    for name, result in results.items():
+        old = baseline.get(name)
+        if old is None or not old['value']:
+            continue
+        change = result['value'] / old['value'] - 1
+        result['change'] = change
+        if change < -threshold:
+            regressions.append(name)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks.bench',
+        description="Benchmark the CPU engines, the compiler and the "
+                    "UI paths.")
+    parser.add_argument('-k', '--filter', default='',
+                        help="only run benchmarks containing this text")
+    parser.add_argument('-t', '--time', type=float, default=1.0,
+                        help="seconds to spend on each benchmark")
+    parser.add_argument('-o', '--output',
+                        help="write the results as JSON to this file")
+    parser.add_argument('-c', '--compare',
+                        help="baseline JSON file to compare against")
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help="slowdown flagged as a regression, "
+                             "0.1 is 10%%")
+    args = parser.parse_args(argv)
+
+    results = {}
+    for name, (function, unit) in BENCHMARKS.items():
+        if args.filter not in name:
+            continue
+        value = function(args.time)
+        results[name] = {'value': value, 'unit': unit}
+        print("{0:<32}{1:>16,.0f} {2}".format(name, value, unit),
+              flush=True)
+
+    status = 0
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.threshold)
+        for name in results:
+            if 'change' in results[name]:
+                print("{0:<32}{1:>+15.1%}{2}".format(
+                    name, results[name]['change'],
+                    "  REGRESSION" if name in regressions else ""))
+        if regressions:
+            status = 1
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'python': platform.python_version(),
+                       'machine': platform.machine(),
+                       'results': results}, f, indent=2)
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
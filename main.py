@@ -1,43 +1,67 @@
 #!/usr/bin/env python3
 
+import argparse
 import curses
+import time
 from curses import wrapper
 from package import textpad
 from curses import ascii
-from package.mpu import CPU
-from package.compiler import Compiler
+from package.mpu import CPU, PROFILES
+from package.clock import Clock
+from package.compiler import Compiler, IncrementalCompiler
+from package.debug import Debugger
 from package.editor import Editor
+from package.engine import create_engine
+from package.history import History
+from package.image import is_hex
+from package.loops import LoopDetector
+from package.profiler import Profiler
+from package.trace import Tracer
+from package.render import Renderer
+
+parser = argparse.ArgumentParser(prog='main.py')
+parser.add_argument('snapshot', nargs='?',
+                    help="machine state saved with the snap command")
+parser.add_argument('-m', '--machine', choices=sorted(PROFILES),
+                    default='mpu8')
+args = parser.parse_args()
 
 ram_row = 0
 ram_col = 0
-cpu = CPU()
-f = cpu.fetch
-d = cpu.decode
-e = cpu.execute
-cpu_cycle = [f, d, e]
-time = 0
+ram_page = 0
+cpu = CPU.from_profile(args.machine)
+history = History(cpu)
+debugger = Debugger()
+cpu.debugger = debugger
+assembler = IncrementalCompiler(cpu.pc.bitWidth.value,
+                                cpu.ram_mem.dataWidth.value)
+frame_rate = 30
 
 
 def main(stdscr: 'curses._CursesWindow'):
+    global ram_page
     curses.curs_set(0)
 
     calc_mode = 'NORM'
     disp_mode = '02X'
     clk_frq = 10
+    clk_max = False
+    fast = False
+    optimize = False
+    clock = Clock(clk_frq)
+    engine = create_engine(cpu)
+    if cpu.ram_mem.dataWidth.value > 8:
+        renderer = Renderer(columns=8, digits=4)
+    else:
+        renderer = Renderer()
+    page_size = renderer.page_size
+    pages = (cpu.ram_mem.addressMaxValue + 1) // page_size
 
     def win_title(window: 'curses._CursesWindow', title: str):
-        height, width = window.getmaxyx()
-        l = len(title)
-        window.box(0, 0)
-        window.addstr(0, (width//2)-l//2, title, curses.A_BOLD)
-        window.refresh()
+        renderer.title(window, title)
 
     def reg_addstr(window: 'curses._CursesWindow', content: str):
-        reg_h, reg_w = window.getmaxyx()
-        l = len(content)
-        window.addstr(reg_h//2, (reg_w//2)-3//2, "   ")
-        window.addstr(reg_h//2, (reg_w//2)-l//2, content)
-        window.refresh()
+        renderer.text(window, content)
 
     def create_ui(window: 'curses._CursesWindow'):
         h, w = window.getmaxyx()
@@ -82,30 +106,104 @@ def main(stdscr: 'curses._CursesWindow'):
         window.refresh()
         curses.napms(1000)
 
-    def return_app(window: 'curses._CursesWindow'):
+    def show_msg(window: 'curses._CursesWindow', msg: str):
         window.move(0, 0)
         window.clrtoeol()
+        window.addstr(0, 0, msg[:window.getmaxyx()[1]-1])
+        window.refresh()
+
+    def prof_out(window: 'curses._CursesWindow', lines: list):
+        h, w = window.getmaxyx()
+        for row in range(1, h-1):
+            window.addstr(row, 1, " " * (w-2))
+        for row, line in enumerate(lines[:h-2]):
+            window.addstr(row+1, 1, line[:w-2])
         window.refresh()
 
-    def ram_out(window: 'curses._CursesWindow', mem: list, index: int, mode: str):
-        out_str = ''
-        for row in range(16):
-            for col in range(16):
-                i = (row*16)+col
-                out_str = format(mem[i], '02X')
-                if i == index and mode == 'PROG':
-                    window.addstr(row+1, (col*3)+1, out_str,
-                                  curses.A_REVERSE)
-                elif i == index and mode == 'NORM':
-                    window.addstr(row+1, (col*3)+1, out_str,
-                                  curses.A_UNDERLINE)
+    def status_out(window: 'curses._CursesWindow'):
+        window.move(0, 0)
+        window.clrtoeol()
+        window.addstr(0, 0, "CLK {0:g} Hz  ACTUAL {1:.0f} Hz".format(
+            clk_frq, clock.achieved))
+        window.noutrefresh()
+
+    def run_ticks(n: int):
+        done = 0
+        while done < n and cpu.is_enabled():
+            if cpu.phase == 0:
+                history.begin()
+            cpu.tick()
+            if cpu.phase == 0:
+                if debugger.resume is None:
+                    history.commit()
                 else:
-                    window.addstr(row+1, (col*3)+1, out_str)
-            window.refresh()
-            out_str = ''
+                    history.cancel()
+            done += 1
+        return done
+
+    def fast_forward(window: 'curses._CursesWindow'):
+        """Runs the program through the engine without animating it.
+
+        Instructions run in batches sized to take about a frame; between
+        batches a key press stops the run and the progress line is
+        refreshed a few times a second. Stepping back cannot reach past
+        the start of a fast run.
+        """
+        while cpu.phase != 0:
+            cpu.tick()
+        history.clear()
+        window.nodelay(True)
+        batch = 1000
+        total = 0
+        stopped = False
+        start = shown = time.perf_counter()
+        try:
+            while cpu.is_enabled():
+                began = time.perf_counter()
+                total += engine.run(batch)
+                now = time.perf_counter()
+                if now - began < 0.5 / frame_rate:
+                    batch *= 2
+                elif now - began > 2 / frame_rate and batch > 1000:
+                    batch //= 2
+                if window.getch() != -1:
+                    cpu.set_enabled(False)
+                    stopped = True
+                elif now - shown >= 0.25:
+                    shown = now
+                    show_msg(window, "FAST {0:,} INSTR  {1:,.0f}/s  "
+                             "ANY KEY STOPS".format(total,
+                                                    total / (now - start)))
+        finally:
+            window.nodelay(False)
+        elapsed = time.perf_counter() - start
+        if debugger.hit is not None:
+            show_msg(window, debugger.hit)
+        elif cpu.detector is not None and cpu.detector.loop is not None:
+            show_msg(window, cpu.detector.report())
+        else:
+            show_msg(window, "{0} {1:,} INSTR IN {2:.2f}s".format(
+                "STOPPED" if stopped else "HALT", total, elapsed))
 
-    def init_ui(ram, txt, mod, dsp, a, b, cz, pc, mode):
-        win_title(ram, "RAM")
+    def return_app(window: 'curses._CursesWindow'):
+        window.move(0, 0)
+        window.clrtoeol()
+        window.refresh()
+
+    def ram_out(window: 'curses._CursesWindow', mem: list, index: int,
+                mode: str):
+        if mode == 'PROG':
+            renderer.ram(window, mem, index, curses.A_REVERSE)
+        elif mode == 'NORM':
+            renderer.ram(window, mem, index, curses.A_UNDERLINE)
+        else:
+            renderer.ram(window, mem, index)
+
+    def init_ui(ram, txt, mod, dsp, a, b, cz, pc, mode, page):
+        if pages > 1:
+            win_title(ram, "RAM " + format(page * page_size, '04X'))
+        else:
+            win_title(ram, "RAM")
         win_title(txt, "EDITOR")
         win_title(mod, "MODE")
         win_title(dsp, "DISP")
@@ -119,6 +217,7 @@ def main(stdscr: 'curses._CursesWindow'):
 
     def get_input(window: 'curses._CursesWindow'):
         window.move(0, 0)
+        window.clrtoeol()
         curses.curs_set(1)
         box = textpad.Textbox(window, insert_mode=True)
         i = box.edit().strip()
@@ -135,20 +234,22 @@ def main(stdscr: 'curses._CursesWindow'):
             return False
 
     def action_up(mode: str):
-        global ram_row
+        global ram_row, ram_page
         if mode == 'PROG':
             if ram_row > 0:
                 ram_row -= 1
             else:
-                ram_row = 15
+                ram_row = renderer.rows - 1
+                ram_page = (ram_page - 1) % pages
 
     def action_down(mode: str):
-        global ram_row
+        global ram_row, ram_page
         if mode == 'PROG':
-            if ram_row < 15:
+            if ram_row < renderer.rows - 1:
                 ram_row += 1
             else:
                 ram_row = 0
+                ram_page = (ram_page + 1) % pages
 
     def action_left(mode: str):
         global ram_col
@@ -156,12 +257,12 @@ def main(stdscr: 'curses._CursesWindow'):
             if ram_col > 0:
                 ram_col -= 1
             else:
-                ram_col = 15
+                ram_col = renderer.columns - 1
 
     def action_right(mode: str):
         global ram_col
         if mode == 'PROG':
-            if ram_col < 15:
+            if ram_col < renderer.columns - 1:
                 ram_col += 1
             else:
                 ram_col = 0
@@ -171,7 +272,7 @@ def main(stdscr: 'curses._CursesWindow'):
             data = get_input(cmd_win)
             if checkHex(data):
                 value = int(data, 16)
-                if value >= 0 and value <= 255:
+                if value >= 0 and value <= cpu.ram_mem.dataMaxValue:
                     cpu.ram_mem.write(
                         ram_index,
                         value
@@ -179,9 +280,16 @@ def main(stdscr: 'curses._CursesWindow'):
         elif mode == 'NORM':
             pass
         elif mode == 'ASML':
-            list = txt_out(txt_win, calc_mode)
-            compiler = Compiler(list)
-            i_list, _ = compiler.compile()
+            txt_out(txt_win, calc_mode)
+            renderer.invalidate()
+            i_list, _ = assembler.image()
+            if optimize and i_list:
+                compiler = Compiler.from_lines(
+                    assembler.texts, cpu.pc.bitWidth.value,
+                    cpu.ram_mem.dataWidth.value, optimize=True)
+                i_list, _ = compiler.compile()
+                show_msg(cmd_win, "OPT -{0} CELLS -{1} INSTR".format(
+                    compiler.saved_cells, compiler.saved_cycles))
             cpu.set_instructions(i_list)
 
     def get_index(mode: str):
@@ -190,16 +298,15 @@ def main(stdscr: 'curses._CursesWindow'):
             pc = cpu.pc.get_counter()
             index = pc
         elif mode == 'PROG':
-            index = ram_row*16 + ram_col
+            index = ram_page*page_size + ram_row*renderer.columns + ram_col
         return index
 
     def dsp_out(window: 'curses._CursesWindow', mode: str):
         if mode == 'PROG':
-            cpu_memory = cpu.ram_mem.get_mem_list()
             reg_addstr(
                 window,
                 format(
-                    cpu_memory[ram_index],
+                    cpu.ram_mem.read(ram_index),
                     disp_mode
                 )
             )
@@ -253,7 +360,7 @@ def main(stdscr: 'curses._CursesWindow'):
             h, w = window.getmaxyx()
             textwin = window.derwin(h-2, w-2, 1, 1)
             textwin.keypad(True)
-            editor = Editor(textwin)
+            editor = Editor(textwin, assembler=assembler)
             curses.curs_set(0)
             return editor.getBuffer().split()
         else:
@@ -262,31 +369,46 @@ def main(stdscr: 'curses._CursesWindow'):
     ui_win, cmd_win, ram_win, txt_win, mod_win, dsp_win, reg_win = create_ui(
         stdscr)
     a_win, b_win, cz_win, pc_win = create_reg_ui(reg_win)
+    cpu_memory = cpu.ram_mem.view()
+    next_frame = 0.0
 
     while True:
 
-        global time
         ram_index = get_index(calc_mode)
-        cpu_memory = cpu.ram_mem.get_mem_list()
-
-        init_ui(ram_win, txt_win, mod_win, dsp_win,
-                a_win, b_win, cz_win, pc_win, calc_mode)
-        ram_out(ram_win, cpu_memory, ram_index, calc_mode)
-        dsp_out(dsp_win, calc_mode)
-        pc_out(pc_win, calc_mode)
-        reg_a_out(a_win, calc_mode)
-        reg_b_out(b_win, calc_mode)
-        reg_cz_out(cz_win, calc_mode)
-        reg_addstr(mod_win, calc_mode)
+
+        if cpu.is_enabled() and fast:
+            fast_forward(cmd_win)
+
+        now = time.perf_counter()
+        if not cpu.is_enabled() or now >= next_frame:
+            next_frame = now + 1 / frame_rate
+            page, offset = divmod(ram_index, page_size)
+            init_ui(ram_win, txt_win, mod_win, dsp_win,
+                    a_win, b_win, cz_win, pc_win, calc_mode, page)
+            ram_out(ram_win, cpu.ram_mem.page(page, page_size), offset,
+                    calc_mode)
+            dsp_out(dsp_win, calc_mode)
+            pc_out(pc_win, calc_mode)
+            reg_a_out(a_win, calc_mode)
+            reg_b_out(b_win, calc_mode)
+            reg_cz_out(cz_win, calc_mode)
+            reg_addstr(mod_win, calc_mode)
+            if cpu.is_enabled():
+                status_out(cmd_win)
+            renderer.update()
 
         cmd = ''
         key = 0
         if cpu.is_enabled():
-            if time > 2:
-                time = 0
-            cpu_cycle[time]()
-            curses.napms(int((1/clk_frq)*1000))
-            time += 1
+            clock.done(run_ticks(clock.due()))
+            if cpu.is_enabled():
+                time.sleep(max(min(clock.wait(),
+                                   next_frame - time.perf_counter()),
+                               0.001))
+            elif debugger.hit is not None:
+                show_msg(cmd_win, debugger.hit)
+            elif cpu.detector is not None and cpu.detector.loop is not None:
+                show_msg(cmd_win, cpu.detector.report())
         else:
             key = cmd_win.getch()
 
@@ -294,6 +416,7 @@ def main(stdscr: 'curses._CursesWindow'):
             cmd = get_input(cmd_win)
         elif key == curses.KEY_RESIZE:
             ui_win.refresh()
+            renderer.invalidate()
         elif key == curses.KEY_UP:
             action_up(calc_mode)
         elif key == curses.KEY_DOWN:
@@ -324,25 +447,164 @@ def main(stdscr: 'curses._CursesWindow'):
             break
         elif cmd == 'reset' and calc_mode == 'NORM':
             cpu.reset()
+            history.clear()
+        elif cmd[:4] == 'back' and calc_mode == 'NORM':
+            arg = cmd[5:]
+            try:
+                n = int(arg) if arg else 1
+                show_msg(cmd_win, "Back " + str(history.back(n)))
+                cpu.set_enabled(False)
+            except ValueError:
+                pass
+        elif cmd[:4] == 'step' and calc_mode == 'NORM':
+            arg = cmd[5:]
+            try:
+                n = int(arg) if arg else 1
+                cpu.set_enabled(True)
+                while cpu.phase != 0:
+                    cpu.tick()
+                if history.pending is not None:
+                    history.commit()
+                debugger.hit = None
+                for _ in range(n):
+                    if not cpu.is_enabled():
+                        break
+                    history.step()
+                if debugger.hit is not None:
+                    show_msg(cmd_win, debugger.hit)
+                cpu.set_enabled(False)
+            except ValueError:
+                pass
 
         elif cmd[:4] == 'mode':
             arg = cmd[5:]
             if arg in ['NORM', 'PROG', 'ASML']:
                 calc_mode = arg
+        elif cmd[:4] == 'page' and calc_mode == 'PROG':
+            arg = cmd[5:]
+            if checkHex(arg) and int(arg, 16) < pages:
+                ram_page = int(arg, 16)
         elif cmd[:4] == 'disp' and calc_mode == 'NORM':
             arg = cmd[5:]
             dict = {'DEC': 'd', 'HEX': '02X'}
             if arg in dict.keys():
                 disp_mode = dict.get(arg, '02X')
-        elif cmd == 'run' and calc_mode == 'NORM':
+        elif cmd in ('run', 'run fast') and calc_mode == 'NORM':
             cpu.reset()
+            history.clear()
+            debugger.reset()
+            if cpu.detector is not None:
+                cpu.detector.close()
+                cpu.detector = LoopDetector(cpu)
+            clock.reset()
+            fast = clk_max or cmd == 'run fast'
             cpu.set_enabled(True)
+        elif cmd == 'cont' and calc_mode == 'NORM':
+            debugger.hit = None
+            clock.reset()
+            fast = clk_max
+            cpu.set_enabled(True)
+        elif cmd[:5] == 'break' and calc_mode == 'NORM':
+            arg = cmd[6:].strip()
+            try:
+                if not arg:
+                    prof_out(txt_win, debugger.report())
+                elif arg == 'clear':
+                    debugger.clear_breaks()
+                elif arg[:4] == 'del ':
+                    debugger.remove(arg[4:])
+                else:
+                    debugger.add(arg)
+            except ValueError as err:
+                show_msg(cmd_win, str(err))
+        elif cmd[:5] == 'watch' and calc_mode == 'NORM':
+            words = cmd[6:].split()
+            if not words:
+                prof_out(txt_win, debugger.report())
+            elif words == ['clear']:
+                debugger.clear_watches()
+            elif words[0] == 'del' and len(words) == 2 and checkHex(words[1]):
+                debugger.unwatch(int(words[1], 16))
+            elif checkHex(words[0]) and len(words) <= 2:
+                kind = words[1].lower() if len(words) == 2 else 'rw'
+                debugger.watch(int(words[0], 16), 'r' in kind, 'w' in kind)
+        elif cmd[:4] == 'prof' and calc_mode == 'NORM':
+            arg = cmd[5:]
+            if arg == 'on':
+                cpu.profiler = Profiler(len(cpu_memory),
+                                        cpu.ram_mem.dataMaxValue + 1)
+            elif arg == 'off':
+                cpu.profiler = None
+            elif cpu.profiler is not None:
+                prof_out(txt_win, cpu.profiler.report(cpu_memory))
+            else:
+                show_msg(cmd_win, "Profiler is off, use 'prof on'")
+        elif cmd in ('opt on', 'opt off'):
+            optimize = cmd == 'opt on'
+        elif cmd[:4] == 'loop' and calc_mode == 'NORM':
+            arg = cmd[5:]
+            if cpu.detector is not None and arg in ('on', 'off'):
+                cpu.detector.close()
+                cpu.detector = None
+            if arg == 'on':
+                cpu.detector = LoopDetector(cpu)
+            elif cpu.detector is not None:
+                show_msg(cmd_win, cpu.detector.report())
+            elif arg != 'off':
+                show_msg(cmd_win, "Loop detection is off, use 'loop on'")
+        elif cmd[:5] == 'trace' and calc_mode == 'NORM':
+            arg = cmd[6:]
+            if cpu.tracer is not None:
+                try:
+                    cpu.tracer.close()
+                except OSError as err:
+                    show_msg(cmd_win, str(err))
+                cpu.tracer = None
+            if arg and arg != 'off':
+                try:
+                    cpu.tracer = Tracer(arg)
+                except OSError as err:
+                    show_msg(cmd_win, str(err))
+        elif cmd[:4] == 'snap' and calc_mode == 'NORM':
+            try:
+                cpu.save_snapshot(cmd[5:])
+            except OSError as err:
+                show_msg(cmd_win, str(err))
+        elif cmd[:7] == 'restore' and calc_mode == 'NORM':
+            try:
+                cpu.load_snapshot(cmd[8:])
+                history.clear()
+            except (OSError, RuntimeError) as err:
+                show_msg(cmd_win, str(err))
+        elif cmd[:4] == 'load' and calc_mode == 'NORM':
+            try:
+                cpu.load_image(cmd[5:])
+                history.clear()
+            except (OSError, RuntimeError) as err:
+                show_msg(cmd_win, str(err))
+        elif cmd[:4] == 'save' and calc_mode == 'NORM':
+            try:
+                cpu.save_image(cmd[5:], sparse=is_hex(cmd[5:]))
+            except OSError as err:
+                show_msg(cmd_win, str(err))
         elif cmd[:3] == 'clk' and calc_mode == 'NORM':
             arg = cmd[4:]
             try:
-                clk_frq = float(arg)
+                if arg == 'max':
+                    clk_max = True
+                elif float(arg) > 0:
+                    clk_max = False
+                    clk_frq = float(arg)
+                    clock.set_frequency(clk_frq)
             except ValueError:
                 pass
 
 
+if args.snapshot:
+    try:
+        cpu.load_snapshot(args.snapshot)
+    except (OSError, RuntimeError) as err:
+        parser.error(str(err))
 wrapper(main)
+if cpu.tracer is not None:
+    cpu.tracer.close()
@@ -0,0 +1,325 @@
+from package.mpu import CPU, Instructions
+
+OPCODES = {int(i.value, 16): i for i in Instructions}
+
+ARG_INSTRUCTIONS = frozenset([
+    Instructions.OUTL, Instructions.OUTR, Instructions.MOVLA,
+    Instructions.MOVLB, Instructions.MOVRA, Instructions.MOVRB,
+    Instructions.MOVAR, Instructions.MOVBR, Instructions.JMPL,
+    Instructions.JMPR, Instructions.JZFL, Instructions.JZFR,
+    Instructions.JCFL, Instructions.JCFR,
+])
+
+JUMP_INSTRUCTIONS = frozenset([
+    Instructions.HALT, Instructions.JMPL, Instructions.JMPR,
+    Instructions.JMPA, Instructions.JMPB, Instructions.JZFL,
+    Instructions.JZFR, Instructions.JZFA, Instructions.JZFB,
+    Instructions.JCFL, Instructions.JCFR, Instructions.JCFA,
+    Instructions.JCFB,
+])
+
+# Expressions for the ALU instructions: (destination, result).
+ALU = {
+    Instructions.ADDA: ('a', 'a + b'),
+    Instructions.ADDB: ('b', 'a + b'),
+    Instructions.SUBBA: ('a', 'a - b'),
+    Instructions.SUBAB: ('b', 'b - a'),
+    Instructions.ANDA: ('a', 'a & b'),
+    Instructions.ANDB: ('b', 'a & b'),
+    Instructions.ORA: ('b', 'a | b'),
+    Instructions.ORB: ('b', 'a | b'),
+}
+
+MAX_BLOCK_LENGTH = 64
+
+# Blocks dropped this many times from one start address are not translated
+# again; their instructions go through the Dispatcher table instead.
+HOT_INVALIDATIONS = 4
+
+
+class Block:
+    def __init__(self, start: int, addresses: list, length: int, run):
+        self.start = start
+        self.addresses = addresses
+        self.length = length
+        self.run = run
+
+
+class BlockCache:
+    """Translates straight-line runs of instructions into Python functions.
+
+    A block starts at any address reached by the program and ends at the
+    first jump or HALT. Operands are folded into the generated code as
+    constants, so a block is dropped as soon as any byte it was translated
+    from is written, whether by MOVAR/MOVBR inside a block or by anyone
+    else through RAM. A block that writes into translated code returns
+    right after the write so the modified bytes are translated afresh.
+    Code which keeps rewriting itself would be translated again on every
+    pass, so once HOT_INVALIDATIONS blocks starting at an address were
+    dropped the instructions there are run one at a time through the
+    Dispatcher table.
+    """
+
+    def __init__(self, cpu: CPU):
+        # The engine module imports this one.
+        from package.engine import Dispatcher
+        self.cpu = cpu
+        size = cpu.ram_mem.addressMaxValue + 1
+        self.blocks = [None] * size
+        self.owners = [[] for _ in range(size)]
+        self.code = bytearray(size)
+        self.dropped = bytearray(size)
+        self.table = Dispatcher(cpu).table
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.dispatched = 0
+        cpu.ram_mem.listeners.append(self.on_write)
+
+    def close(self):
+        self.cpu.ram_mem.listeners.remove(self.on_write)
+
+    def on_write(self, start: int, stop: int):
+        code = self.code
+        for address in range(start, stop):
+            if code[address]:
+                self.invalidate(address)
+
+    def invalidate(self, address: int):
+        for start in list(self.owners[address]):
+            block = self.blocks[start]
+            self.blocks[start] = None
+            for a in block.addresses:
+                self.owners[a].remove(start)
+                self.code[a] -= 1
+            if self.dropped[start] < HOT_INVALIDATIONS:
+                self.dropped[start] += 1
+            self.invalidations += 1
+
+    def flush(self):
+        for start, block in enumerate(self.blocks):
+            if block is not None:
+                self.invalidate(start)
+        self.dropped[:] = bytes(len(self.dropped))
+
+    def stats(self):
+        return {
+            'blocks': sum(b is not None for b in self.blocks),
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+            'dispatched': self.dispatched,
+        }
+
+    def translate(self, start: int):
+        cpu = self.cpu
+        mem = cpu.ram_mem.memory
+        amask = cpu.pc.maxValue
+        dmax = cpu.reg_a.maxValue
+        cells = cpu.operand_cells
+        shift = cpu.ram_mem.dataWidth.value
+
+        lines = []
+        addresses = []
+        alu = False
+
+        def writeback(indent: str, pc: str):
+            out = [indent + "reg_a.value = a", indent + "reg_b.value = b"]
+            if alu:
+                out.append(indent + "cpu.alu_result = num")
+            out.append(indent + "counter.value = " + pc)
+            return out
+
+        def leave(indent: str, pc: str, count: int):
+            return writeback(indent, pc) + [indent + "return " + str(count)]
+
+        def jump(indent: str, target: str, count: int):
+            out = [indent + "t = " + target,
+                   indent + "if not 0 <= t <= AMASK:"]
+            out += writeback(indent + "    ", str((op_pc + 1) & amask))
+            out.append(indent + "    raise AssertionError(t)")
+            return out + leave(indent, "t", count)
+
+        def pointer(address: int):
+            return " | ".join(
+                "mem[{0}] << {1}".format((address + i) & amask, i * shift)
+                if i else "mem[{0}]".format(address)
+                for i in range(cells))
+
+        def store(dest: str, value: str):
+            lines.append("    {0} = {1}".format(dest, value))
+            lines.append("    if {0} > DMAX: {0} -= DMAX".format(dest))
+
+        def output(value: str):
+            lines.append("    o = " + value)
+            lines.append("    if o > DMAX: o -= DMAX")
+            lines.append("    reg_out.value = o")
+            lines.append("    if cpu.out_history is not None: "
+                         "cpu.out_history.append(o)")
+
+        pc = start
+        count = 0
+        terminated = False
+        while count < MAX_BLOCK_LENGTH:
+            op_pc = pc
+            instruction = OPCODES.get(mem[pc])
+            addresses.append(pc)
+            pc = (pc + 1) & amask
+            arg = None
+            if instruction in ARG_INSTRUCTIONS:
+                arg = 0
+                for i in range(cells):
+                    arg |= mem[pc] << (i * shift)
+                    addresses.append(pc)
+                    pc = (pc + 1) & amask
+            count += 1
+            after = str(pc)
+
+            if instruction is None:
+                pass
+            elif instruction == Instructions.HALT:
+                lines.append("    cpu.enable = False")
+                lines += leave("    ", after, count)
+            elif instruction == Instructions.OUTL:
+                output(str(arg))
+            elif instruction == Instructions.OUTR:
+                output("mem[{0}]".format(arg))
+            elif instruction == Instructions.OUTA:
+                output("a")
+            elif instruction == Instructions.OUTB:
+                output("b")
+            elif instruction == Instructions.MOVLA:
+                store("a", str(arg))
+            elif instruction == Instructions.MOVLB:
+                store("b", str(arg))
+            elif instruction == Instructions.MOVRA:
+                store("a", "mem[{0}]".format(arg))
+            elif instruction == Instructions.MOVRB:
+                store("b", "mem[{0}]".format(arg))
+            elif instruction in (Instructions.MOVAR, Instructions.MOVBR):
+                src = 'a' if instruction == Instructions.MOVAR else 'b'
+                lines.append("    v = " + src)
+                lines.append("    if v > DMAX: v -= DMAX")
+                lines.append("    mem[{0}] = v & DMAX".format(arg))
+                lines.append("    hit = code[{0}]".format(arg))
+                lines.append("    if listeners: notify({0}, {1})".format(
+                    arg, arg + 1))
+                lines.append("    if hit:")
+                lines += leave("        ", after, count)
+            elif instruction in ALU:
+                dest, expr = ALU[instruction]
+                alu = True
+                lines.append("    num = " + expr)
+                store(dest, "num")
+            elif instruction == Instructions.JMPL:
+                lines += leave("    ", str(arg), count)
+            elif instruction == Instructions.JMPR:
+                lines += leave("    ", pointer(arg), count)
+            elif instruction in (Instructions.JMPA, Instructions.JMPB):
+                src = 'a' if instruction == Instructions.JMPA else 'b'
+                lines += jump("    ", src, count)
+            else:
+                name = instruction.name
+                if alu:
+                    flag = "num == 0" if name[1] == 'Z' else "num > DMAX"
+                else:
+                    flag = "cpu.zero" if name[1] == 'Z' else "cpu.carry"
+                lines.append("    if " + flag + ":")
+                if name[3] == 'L':
+                    lines += leave("        ", str(arg), count)
+                elif name[3] == 'R':
+                    lines += leave("        ", pointer(arg), count)
+                else:
+                    lines += jump("        ", 'a' if name[3] == 'A' else 'b',
+                                  count)
+                lines += leave("    ", after, count)
+            if instruction in JUMP_INSTRUCTIONS:
+                terminated = True
+                break
+        if not terminated:
+            lines += leave("    ", str(pc), count)
+
+        source = "\n".join(["def block():",
+                            "    a = reg_a.value",
+                            "    b = reg_b.value"] + lines)
+        namespace = {
+            'cpu': cpu,
+            'mem': mem,
+            'code': self.code,
+            'counter': cpu.pc,
+            'reg_a': cpu.reg_a,
+            'reg_b': cpu.reg_b,
+            'reg_out': cpu.reg_out,
+            'listeners': cpu.ram_mem.listeners,
+            'notify': cpu.ram_mem.notify,
+            'AMASK': amask,
+            'DMAX': dmax,
+        }
+        exec(compile(source, "<block {0:02X}>".format(start), 'exec'),
+             namespace)
+
+        block = Block(start, addresses, count, namespace['block'])
+        self.blocks[start] = block
+        for a in addresses:
+            self.owners[a].append(start)
+            self.code[a] += 1
+        return block
+
+    def step(self):
+        self.cpu.step()
+
+    def run(self, max_cycles=None):
+        cpu = self.cpu
+        if cpu.observer() is not None or \
+                cpu.debugger is not None and cpu.debugger.active():
+            # Blocks are not instrumented; observe one instruction at a time.
+            count = 0
+            while cpu.enable and (max_cycles is None or count < max_cycles):
+                if not cpu.step():
+                    break
+                count += 1
+            return count
+        if cpu.debugger is not None:
+            # Nothing can stop the instruction a resume would skip.
+            cpu.debugger.take_resume()
+        counter = cpu.pc
+        mem = cpu.ram_mem.memory
+        amask = counter.maxValue
+        blocks = self.blocks
+        dropped = self.dropped
+        table = self.table
+        translate = self.translate
+        step = cpu.step
+        count = 0
+        hits = 0
+        misses = 0
+        dispatched = 0
+        try:
+            while cpu.enable:
+                pc = counter.value
+                block = blocks[pc]
+                if block is None:
+                    if dropped[pc] >= HOT_INVALIDATIONS:
+                        if max_cycles is not None and count >= max_cycles:
+                            break
+                        counter.value = table[mem[pc]]((pc + 1) & amask)
+                        count += 1
+                        dispatched += 1
+                        continue
+                    block = translate(pc)
+                    misses += 1
+                else:
+                    hits += 1
+                if max_cycles is not None and \
+                        count + block.length > max_cycles:
+                    if count >= max_cycles:
+                        break
+                    step()
+                    count += 1
+                    continue
+                count += block.run()
+        finally:
+            self.hits += hits
+            self.misses += misses
+            self.dispatched += dispatched
+        return count
@@ -0,0 +1,127 @@
+import hashlib
+import os
+import sys
+import tempfile
+from array import array
+from collections import OrderedDict
+
+from package.compiler import VERSION, Compiler, CompilerError
+
+
+def source_key(source, address_bits: int = 8, data_bits: int = 8,
+               optimize: bool = False):
+    """Hashes the tokens of source together with the assembler version.
+
+    The assembler only sees whitespace separated tokens, so sources that
+    differ in layout alone share a key. The machine and whether the
+    program is optimized are part of the key as they change the image.
+    """
+    tokens = source.split() if isinstance(source, str) else source
+    digest = hashlib.sha256(VERSION.encode())
+    if (address_bits, data_bits) != (8, 8):
+        digest.update("/{0}/{1}".format(address_bits, data_bits).encode())
+    if optimize:
+        digest.update(b'/O')
+    digest.update(b'\0')
+    digest.update(" ".join(tokens).encode())
+    return digest.hexdigest()
+
+
+class CompileCache:
+    """Remembers assembled images by the hash of their source.
+
+    The most recently used size images are kept in memory. With a
+    directory each image is also stored there as one small file named by
+    its key, holding the error code followed by the image, so separate
+    runs and worker processes share their results. Images of 16 bit
+    cells are stored little-endian.
+    """
+
+    def __init__(self, size: int = 128, directory: str = None,
+                 address_bits: int = 8, data_bits: int = 8,
+                 optimize: bool = False):
+        self.size = size
+        self.directory = directory
+        self.address_bits = address_bits
+        self.data_bits = data_bits
+        self.optimize = optimize
+        self.typecode = 'B' if data_bits <= 8 else 'H'
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self):
+        return {
+            'entries': len(self.entries),
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+        }
+
+    def path(self, key: str):
+        return os.path.join(self.directory, key + '.bin')
+
+    def load(self, key: str):
+        try:
+            with open(self.path(key), 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+        cells = array(self.typecode)
+        if len(data) not in (1, 1 + (cells.itemsize << self.address_bits)):
+            return None
+        cells.frombytes(data[1:])
+        if cells.itemsize > 1 and sys.byteorder == 'big':
+            cells.byteswap()
+        return cells.tolist(), CompilerError(data[0])
+
+    def pack(self, image: list):
+        cells = array(self.typecode, image)
+        if cells.itemsize > 1 and sys.byteorder == 'big':
+            cells.byteswap()
+        return cells
+
+    def store(self, key: str, image: list, error: CompilerError):
+        os.makedirs(self.directory, exist_ok=True)
+        fd, temp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(bytes([error.value]) + self.pack(image).tobytes())
+            os.replace(temp, self.path(key))
+        except OSError:
+            if os.path.exists(temp):
+                os.remove(temp)
+
+    def remember(self, key: str, entry: tuple):
+        self.entries[key] = entry
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def compile(self, source):
+        """Returns (image, error) for source, a string or a token list."""
+        key = source_key(source, self.address_bits, self.data_bits,
+                         self.optimize)
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return list(entry[0]), entry[1]
+        if self.directory is not None:
+            entry = self.load(key)
+            if entry is not None:
+                self.disk_hits += 1
+                self.remember(key, (array(self.typecode, entry[0]),
+                                    entry[1]))
+                return entry
+        self.misses += 1
+        tokens = source.split() if isinstance(source, str) else list(source)
+        image, error = Compiler(tokens, self.address_bits,
+                                self.data_bits, self.optimize).compile()
+        self.remember(key, (array(self.typecode, image), error))
+        if self.directory is not None:
+            self.store(key, image, error)
+        return image, error
@@ -0,0 +1,51 @@
+import time
+
+
+class Clock:
+    """Tells the run loop how many clock ticks are due at each moment.
+
+    Ticks are owed in proportion to the time measured with perf_counter
+    since the previous call, and the fraction of a tick left over is
+    carried forward, so the average rate does not drift however long
+    rendering takes. After a stall longer than max_lag the backlog is
+    dropped instead of being run all at once.
+    """
+
+    def __init__(self, frequency: float, max_lag: float = 0.25):
+        self.frequency = frequency
+        self.max_lag = max_lag
+        self.reset()
+
+    def reset(self):
+        self.last = time.perf_counter()
+        self.owed = 0.0
+        self.window_start = self.last
+        self.window_ticks = 0
+        self.achieved = 0.0
+
+    def set_frequency(self, frequency: float):
+        self.frequency = frequency
+        self.reset()
+
+    def due(self):
+        now = time.perf_counter()
+        self.owed += (now - self.last) * self.frequency
+        self.last = now
+        self.owed = min(self.owed, self.frequency * self.max_lag + 1)
+        ticks = int(self.owed)
+        self.owed -= ticks
+        return ticks
+
+    def done(self, ticks: int):
+        """Counts executed ticks towards the achieved frequency."""
+        self.window_ticks += ticks
+        now = time.perf_counter()
+        if now - self.window_start >= 0.5:
+            self.achieved = self.window_ticks / (now - self.window_start)
+            self.window_start = now
+            self.window_ticks = 0
+
+    def wait(self):
+        """Seconds until the next tick is due."""
+        return max((1 - self.owed) / self.frequency -
+                   (time.perf_counter() - self.last), 0.0)
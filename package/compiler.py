@@ -1,3 +1,6 @@
+import re
+from bisect import bisect_left
+from collections import namedtuple
 from enum import Enum, unique
 
 
@@ -56,19 +59,70 @@ class CompilerError(Enum):
     MaxInstructionsError = 4
 
 
+# Part of every compile cache key, bump it whenever the output changes.
+VERSION = '2'
+
+OPCODES = {i.name: int(i.value, 16) for i in Instructions}
+
+ARG_INSTRUCTIONS = frozenset(['OUTL', 'OUTR', 'MOVLA',
+                              'MOVLB', 'MOVRA', 'MOVRB',
+                              'MOVAR', 'MOVBR', 'JMPL',
+                              'JMPR', 'JZFL', 'JZFR',
+                              'JCFL', 'JCFR'])
+
+Token = namedtuple('Token', ['text', 'line', 'col'])
+
+WORD = re.compile(r'\S+')
+
+
+def tokenize(lines):
+    """Yields the tokens of an iterable of lines with 1-based positions."""
+    for line, text in enumerate(lines, 1):
+        for match in WORD.finditer(text):
+            yield Token(match.group(), line, match.start() + 1)
+
+
 class Compiler:
-    def __init__(self, list: list):
+    """Assembles tokens into an image of 2 ** address_bits cells.
+
+    Every operand holds an address, so when addresses are wider than a
+    cell it is emitted over several cells, low cell first. With optimize
+    the Optimizer rewrites the program once it is assembled, leaving the
+    cells and estimated instructions per run it saved in saved_cells and
+    saved_cycles.
+    """
+
+    def __init__(self, list, address_bits: int = 8, data_bits: int = 8,
+                 optimize: bool = False):
         self.list = list
-        self.instructions = [e.name for e in Instructions]
-        self.arg_instructions = ['OUTL', 'OUTR', 'MOVLA',
-                                 'MOVLB', 'MOVRA', 'MOVRB',
-                                 'MOVAR', 'MOVBR', 'JMPL',
-                                 'JMPR', 'JZFL', 'JZFR',
-                                 'JCFL', 'JCFR']
+        self.size = 1 << address_bits
+        self.data_bits = data_bits
+        self.data_max = (1 << data_bits) - 1
+        self.operand_cells = address_bits // data_bits
         self.label = "#"
         self.counter = 0
         self.mem_dict = dict()
+        self.positions = dict()
         self.error_code = CompilerError.NoError
+        self.error_token = None
+        self.compiled = False
+        self.optimize = optimize
+        self.saved_cells = 0
+        self.saved_cycles = 0
+
+    @classmethod
+    def from_lines(cls, lines, address_bits: int = 8, data_bits: int = 8,
+                   optimize: bool = False):
+        """Assembles from any iterable of lines, such as an open file."""
+        return cls(tokenize(lines), address_bits, data_bits, optimize)
+
+    @classmethod
+    def from_file(cls, path: str, address_bits: int = 8, data_bits: int = 8,
+                  optimize: bool = False):
+        with open(path) as f:
+            compiler = cls.from_lines(f, address_bits, data_bits, optimize)
+            compiler.compile()
+        return compiler
 
     @staticmethod
     def checkHex(hexstring: str):
@@ -79,77 +133,699 @@ class Compiler:
             return False
 
     def checkInstruction(self, instruction: str):
-        if instruction in self.instructions:
-            return True
-        else:
-            return False
+        return instruction in OPCODES
 
     def checkArg(self, instruction: str):
-        b = False
-        if instruction in self.arg_instructions:
-            b = True
-        return b
+        return instruction in ARG_INSTRUCTIONS
 
     def checkLabel(self, instruction: str):
-        b = False
-        if instruction[:1] == self.label:
-            b = True
-        return b
+        return instruction[:1] == self.label
 
     def getCount(self):
         return self.counter
 
+    def tokens(self):
+        # Plain strings carry no position; their index stands in as column.
+        for n, token in enumerate(self.list):
+            if isinstance(token, Token):
+                yield token
+            else:
+                yield Token(token, 0, n)
+
+    def emit(self, value: int, token: Token):
+        self.mem_dict[self.counter] = value
+        self.positions[self.counter] = (token.line, token.col)
+        self.counter += 1
+
+    def emit_operand(self, value: int, token: Token):
+        if self.operand_cells == 1:
+            self.emit(value, token)
+            return
+        for _ in range(self.operand_cells):
+            self.emit(value & self.data_max, token)
+            value >>= self.data_bits
+
     def compile(self):
-        n = 0
-        while n < len(self.list):
-            i = self.list[n]
-            if self.checkInstruction(i):
-                pos = self.counter
-                opcode = Instructions.find_opcode(i)
-                self.mem_dict[pos] = opcode
-                self.counter += 1
-                if self.checkArg(i):
-                    pos = self.counter
-                    n += 1
-                    arg = self.list[n]
-                    if self.checkHex(arg):
-                        self.mem_dict[pos] = arg
-                        self.counter += 1
-                    else:
+        if self.compiled:
+            return self.image()
+        self.compiled = True
+        starts = [] if self.optimize else None
+        labels = set()
+        tokens = self.tokens()
+        for token in tokens:
+            i = token.text
+            opcode = OPCODES.get(i)
+            if opcode is not None:
+                if starts is not None:
+                    starts.append(self.counter)
+                self.emit(opcode, token)
+                if i in ARG_INSTRUCTIONS:
+                    arg = next(tokens, None)
+                    try:
+                        value = int(arg.text, 16)
+                    except (AttributeError, ValueError):
                         self.error_code = CompilerError.ArgumentError
+                        self.error_token = arg or token
                         break
-            else:
-                if self.checkLabel(i):
-                    label = i[1:]
-                    if self.checkHex(label):
-                        c = int(label, 16)
-                        if c not in self.mem_dict:
-                            self.counter = c
-                        else:
-                            self.error_code = CompilerError.LabelError
-                            break
-                    else:
-                        self.error_code = CompilerError.LabelError
-                        break
-                else:
-                    self.error_code = CompilerError.InstructionError
+                    self.emit_operand(value, arg)
+            elif i[:1] == self.label:
+                try:
+                    c = int(i[1:], 16)
+                except ValueError:
+                    c = None
+                if c is None or c in self.mem_dict:
+                    self.error_code = CompilerError.LabelError
+                    self.error_token = token
                     break
-            n += 1
+                labels.add(c)
+                self.counter = c
+            else:
+                self.error_code = CompilerError.InstructionError
+                self.error_token = token
+                break
 
-        if self.getCount() >= 256:
+        if self.getCount() >= self.size:
             self.error_code = CompilerError.MaxInstructionsError
+        if starts is not None and self.error_code == CompilerError.NoError:
+            optimizer = Optimizer(self)
+            optimizer.optimize(starts, labels)
+            self.saved_cells = optimizer.saved_cells
+            self.saved_cycles = optimizer.saved_cycles
+        return self.image()
+
+    def image(self):
         if self.error_code == CompilerError.NoError:
-            mem_list = []
-            for i in range(256):
-                mem_list.append(self.mem_dict.get(i, "00"))
-            return [int(e, 16) for e in mem_list], self.error_code
+            get = self.mem_dict.get
+            return [get(i, 0) for i in range(self.size)], self.error_code
         else:
             return [], self.error_code
 
 
+# Registers each instruction reads and writes: A, B, the flags F and OUT O.
+EFFECTS = {
+    'HALT': ('', ''), 'OUTL': ('', 'O'), 'OUTR': ('', 'O'),
+    'OUTA': ('A', 'O'), 'OUTB': ('B', 'O'),
+    'MOVLA': ('', 'A'), 'MOVLB': ('', 'B'),
+    'MOVRA': ('', 'A'), 'MOVRB': ('', 'B'),
+    'MOVAR': ('A', ''), 'MOVBR': ('B', ''),
+    'ADDA': ('AB', 'AF'), 'ADDB': ('AB', 'BF'),
+    'SUBBA': ('AB', 'AF'), 'SUBAB': ('AB', 'BF'),
+    'ANDA': ('AB', 'AF'), 'ANDB': ('AB', 'BF'),
+    'ORA': ('AB', 'BF'), 'ORB': ('AB', 'BF'),
+    'JMPL': ('', ''), 'JMPR': ('', ''), 'JMPA': ('A', ''), 'JMPB': ('B', ''),
+    'JZFL': ('F', ''), 'JZFR': ('F', ''),
+    'JZFA': ('AF', ''), 'JZFB': ('BF', ''),
+    'JCFL': ('F', ''), 'JCFR': ('F', ''),
+    'JCFA': ('AF', ''), 'JCFB': ('BF', ''),
+}
+
+NAMES = {int(i.value, 16): i.name for i in Instructions}
+JUMPS = frozenset(['JMPL', 'JZFL', 'JCFL'])
+COMPUTED_JUMPS = frozenset(['JMPR', 'JZFR', 'JCFR', 'JMPA', 'JMPB',
+                            'JZFA', 'JZFB', 'JCFA', 'JCFB'])
+MEMORY_READS = frozenset(['OUTR', 'MOVRA', 'MOVRB'])
+MEMORY_WRITES = frozenset(['MOVAR', 'MOVBR'])
+LOADS = frozenset(['MOVLA', 'MOVLB', 'MOVRA', 'MOVRB'])
+# Instructions after which execution does not continue with the next one.
+STOPS = frozenset(['HALT', 'JMPL', 'JMPR', 'JMPA', 'JMPB'])
+
+
+class Op:
+    """One assembled instruction as seen by the Optimizer."""
+
+    def __init__(self, address: int, name: str, arg: int, size: int,
+                 positions: list):
+        self.address = address
+        self.name = name
+        self.arg = arg
+        self.size = size
+        self.positions = positions
+        self.removed = False
+        self.next = None
+
+    def touches(self, cells: set):
+        return any(a in cells for a in
+                   range(self.address, self.address + self.size))
+
+
+class Optimizer:
+    """Peephole pass over the image assembled by a Compiler.
+
+    Only programs whose every instruction is known are changed: none
+    jumping through a register or RAM, into an instruction or into cells
+    written at runtime, and none rewriting an opcode or the operand of an
+    instruction accessing RAM. In those, jumps to an unconditional JMPL
+    are threaded to its final target. Programs which also neither read
+    nor write assembled cells lose the code not reachable from address 0,
+    JMPLs to the next instruction, loads and RAM stores overwritten
+    before anything reads them and MOVLA/MOVLB/MOVRA/MOVRB reloading the
+    value a register already holds.
+    The code after each removed instruction moves up, every run of code
+    keeps the address it starts at, as set by its # label, and jump
+    operands are relocated. A run that may go on into the code at a #
+    label right after it is kept whole, as moving up would leave a gap.
+    Instructions whose cells are read or written by the program are
+    barriers which are never changed.
+    """
+
+    def __init__(self, compiler: 'Compiler'):
+        self.compiler = compiler
+        self.size = compiler.size
+        self.saved_cells = 0
+        self.saved_cycles = 0
+
+    def decode(self, starts: list):
+        compiler = self.compiler
+        cells = compiler.mem_dict
+        positions = compiler.positions
+        ops = []
+        for address in sorted(starts):
+            if cells.get(address) not in NAMES:
+                return None     # A later # overwrote the opcode.
+            name = NAMES[cells[address]]
+            size = 1 + compiler.operand_cells if name in ARG_INSTRUCTIONS \
+                else 1
+            if any(a not in cells for a in range(address, address + size)):
+                return None
+            arg = None
+            if size > 1:
+                arg = 0
+                for i in range(compiler.operand_cells):
+                    arg |= cells[address + 1 + i] << (i * compiler.data_bits)
+            ops.append(Op(address, name, arg, size,
+                          [positions[a] for a in
+                           range(address, address + size)]))
+        if sum(op.size for op in ops) != len(cells):
+            return None     # Instructions overwrote each other.
+        for op, following in zip(ops, ops[1:]):
+            if op.address + op.size == following.address:
+                op.next = following
+        return ops
+
+    def optimize(self, starts: list, labels: set):
+        ops = self.decode(starts)
+        if ops is None:
+            return
+        self.ops = ops
+        self.at = {op.address: op for op in ops}
+        self.labels = labels
+        self.fixed = self.pinned()
+        cells = self.compiler.mem_dict
+        reads = set()
+        writes = set()
+        for op in ops:
+            if op.name in MEMORY_READS:
+                reads.add(op.arg)
+            elif op.name in MEMORY_WRITES:
+                writes.add(op.arg)
+            elif op.name in ('JMPR', 'JZFR', 'JCFR'):
+                reads.update((op.arg + i) & (self.size - 1)
+                             for i in range(self.compiler.operand_cells))
+        barriers = (reads | writes) & set(cells)
+        if not self.known(cells, writes, barriers):
+            return
+        self.thread(barriers)
+        if not barriers and self.relocatable():
+            changed = True
+            while changed:
+                changed = self.unreachable()
+                changed |= self.jumps_to_next()
+                changed |= self.dead_stores()
+                changed |= self.reloads()
+        self.compact()
+
+    def known(self, cells: dict, writes: set, barriers: set):
+        """Whether every instruction that can run is one of the assembled
+        ones, unchanged but for the operands in barriers, and every cell
+        read or written by the program is known."""
+        for op in self.ops:
+            if op.name in COMPUTED_JUMPS or op.address in writes:
+                return False
+            if op.name in MEMORY_READS | MEMORY_WRITES and \
+                    op.touches(barriers):
+                return False
+            if op.name in JUMPS and \
+                    (op.arg in writes or
+                     op.arg in cells and op.arg not in self.at):
+                return False
+            if op.next is None and op.name not in STOPS and \
+                    op.address + op.size in writes:
+                return False
+        return True
+
+    def relocatable(self):
+        """Whether no code runs past the end of RAM into address 0, which
+        moving code up would change."""
+        return not any(op.next is None and op.name not in STOPS and
+                       op.address + op.size >= self.size for op in self.ops)
+
+    def kept(self, op: Op, fixed: bool):
+        """op, or the first instruction after it not removed. Code at a
+        # label only follows on from a run whose code stays in place,
+        one that is fixed, so past a label in any other run it is None."""
+        while op is not None and op.removed:
+            op = op.next
+            if op is not None and op.address in self.labels and not fixed:
+                return None
+        return op
+
+    def landing(self, address: int):
+        """The instruction a jump to address arrives at."""
+        op = self.at.get(address)
+        return self.kept(op, op is not None and op.address in self.fixed)
+
+    def target(self, op: Op):
+        """The instruction op jumps to, skipping removed ones."""
+        return self.landing(op.arg)
+
+    def following(self, op: Op):
+        fixed = op.address in self.fixed
+        if op.next is not None and op.next.address in self.labels and \
+                not fixed:
+            return None
+        return self.kept(op.next, fixed)
+
+    def thread(self, barriers: set):
+        for op in self.ops:
+            if op.name not in JUMPS or op.touches(barriers):
+                continue
+            seen = {op.address}
+            hop = self.at.get(op.arg)
+            hops = 0
+            while hop is not None and hop.name == 'JMPL' and \
+                    hop.address not in seen and not hop.touches(barriers):
+                seen.add(hop.address)
+                op.arg = hop.arg
+                hops += 1
+                hop = self.at.get(op.arg)
+            self.saved_cycles += hops
+
+    def runs(self):
+        """The runs of contiguous code, each starting after a gap or at
+        a # label."""
+        run = []
+        for op in self.ops:
+            if run and (run[-1].next is not op or op.address in self.labels):
+                yield run
+                run = []
+            run.append(op)
+        if run:
+            yield run
+
+    def pinned(self):
+        """Addresses of the instructions in runs that may continue
+        straight into code placed by a # label, which a shorter run would
+        leave a gap before."""
+        fixed = set()
+        for run in self.runs():
+            last = run[-1]
+            if last.next is not None and \
+                    (last.name not in STOPS or last.name == 'JMPL'):
+                fixed.update(op.address for op in run)
+        return fixed
+
+    def remove(self, op: Op, cycles: int):
+        """Removes op unless its run is pinned, returning whether it
+        did."""
+        if op.address in self.fixed:
+            return False
+        op.removed = True
+        self.saved_cells += op.size
+        self.saved_cycles += cycles
+        return True
+
+    def unreachable(self):
+        live = set()
+        todo = [self.landing(0)]
+        while todo:
+            op = todo.pop()
+            if op is None or op.address in live:
+                continue
+            live.add(op.address)
+            if op.name in JUMPS:
+                todo.append(self.target(op))
+            if op.name not in STOPS:
+                todo.append(self.following(op))
+        changed = False
+        for op in self.ops:
+            if not op.removed and op.address not in live:
+                changed |= self.remove(op, 0)
+        return changed
+
+    def jumps_to_next(self):
+        changed = False
+        for op in self.ops:
+            if op.removed or op.name not in JUMPS:
+                continue
+            following = self.following(op)
+            if op.arg == op.address + op.size or \
+                    following is not None and self.target(op) is following:
+                changed |= self.remove(op, 1)
+        return changed
+
+    def leaders(self):
+        """Addresses execution can arrive at other than from the
+        instruction before."""
+        found = {0}
+        for op in self.ops:
+            if not op.removed and op.name in JUMPS:
+                target = self.target(op)
+                if target is not None:
+                    found.add(target.address)
+        return found
+
+    def overwritten(self, op: Op):
+        """Whether what op stores is replaced before anything reads it on
+        the straight line of code following it."""
+        register = EFFECTS[op.name][1]
+        following = self.following(op)
+        while following is not None:
+            reads, writes = EFFECTS[following.name]
+            if op.name in MEMORY_WRITES:
+                if following.name in MEMORY_READS and following.arg == op.arg:
+                    return False
+                if following.name in MEMORY_WRITES and \
+                        following.arg == op.arg:
+                    return True
+            elif register in reads:
+                return False
+            elif register in writes:
+                return True
+            if following.name in STOPS or following.name in JUMPS:
+                return False
+            following = self.following(following)
+        return False
+
+    def dead_stores(self):
+        changed = False
+        for op in self.ops:
+            if not op.removed and (op.name in LOADS or
+                                   op.name in MEMORY_WRITES) and \
+                    self.overwritten(op):
+                changed |= self.remove(op, 1)
+        return changed
+
+    def reloads(self):
+        leaders = self.leaders()
+        changed = False
+        known = {}
+        previous = None
+        for op in self.ops:
+            if op.removed:
+                continue
+            if op.address in leaders or previous is None or \
+                    self.following(previous) is not op or \
+                    previous.name in STOPS:
+                known = {}
+            previous = op
+            reads, writes = EFFECTS[op.name]
+            if op.name in LOADS:
+                value = ('L' if op.name in ('MOVLA', 'MOVLB') else 'R',
+                         op.arg)
+                register = writes
+                if known.get(register) == value and self.remove(op, 1):
+                    changed = True
+                    continue
+                known[register] = value
+                continue
+            if op.name in MEMORY_WRITES:
+                known = {r: v for r, v in known.items() if v != ('R', op.arg)}
+            for register in writes:
+                known.pop(register, None)
+        return changed
+
+    def compact(self):
+        compiler = self.compiler
+        ops = self.ops
+        moved = {}
+        for run in self.runs():
+            address = run[0].address
+            for op in run:
+                moved[op.address] = address
+                if not op.removed:
+                    address += op.size
+        cells = dict()
+        positions = dict()
+        for op in ops:
+            if op.removed:
+                continue
+            values = [OPCODES[op.name]]
+            if op.arg is not None:
+                arg = op.arg
+                if op.name in JUMPS and arg in moved:
+                    arg = moved[arg]
+                for _ in range(compiler.operand_cells):
+                    values.append(arg & compiler.data_max)
+                    arg >>= compiler.data_bits
+            start = moved[op.address]
+            for i, value in enumerate(values):
+                cells[start + i] = value
+                positions[start + i] = op.positions[i]
+        compiler.mem_dict = cells
+        compiler.positions = positions
+
+
+# What assembling one line produced. segments are (label column, address
+# before the label, start, cells) runs, the first one unlabelled;
+# diagnostics are (column, error, address) in the order found. pending is
+# the column of an instruction still waiting for its argument, 0 if it is
+# on an earlier line and None if there is none.
+LineResult = namedtuple('LineResult', ['address', 'end', 'pending',
+                                       'segments', 'diagnostics'])
+
+
+class IncrementalCompiler:
+    """Assembles a list of lines, redoing only the lines that changed.
+
+    A line is assembled from its text, the address it starts at and
+    whether it starts with the argument of an instruction on an earlier
+    line. replace is told which lines an edit changed; it keeps the
+    results of the lines before and after them and re-assembles from the
+    edit until a line starts in the same state as before, so an edit
+    that does not move the code after it costs the same on any length of
+    program. Lines without labels that only moved are relocated rather
+    than assembled again. update finds the changed lines of a whole new
+    text itself. Overlapping labels need the whole program; as
+    everything between two labels is written contiguously, only the
+    lines with labels, errors or a dangling instruction, kept in marked,
+    are looked at to find them. Unlike Compiler it does not stop at the
+    first error, so every line gets its diagnostics, but image returns
+    the same result as Compiler.compile on the same text.
+    """
+
+    def __init__(self, address_bits: int = 8, data_bits: int = 8):
+        self.address_bits = address_bits
+        self.data_bits = data_bits
+        self.size = 1 << address_bits
+        self.texts = []
+        self.results = []
+        self.marked = []
+        self.errors = dict()
+        self.first_error = None
+        self.end = 0
+        self.assembled = 0
+
+    def assemble_line(self, text: str, address: int, pending: bool):
+        compiler = Compiler([], self.address_bits, self.data_bits)
+        compiler.counter = address
+        pending = 0 if pending else None
+        segments = [(None, address, address, [])]
+        diagnostics = []
+        for match in WORD.finditer(text):
+            i = match.group()
+            col = match.start() + 1
+            if pending is not None:
+                pending = None
+                try:
+                    value = int(i, 16)
+                except ValueError:
+                    diagnostics.append((col, CompilerError.ArgumentError,
+                                        compiler.counter))
+                    continue
+                compiler.emit_operand(value, Token(i, 0, col))
+                continue
+            opcode = OPCODES.get(i)
+            if opcode is not None:
+                compiler.emit(opcode, Token(i, 0, col))
+                if i in ARG_INSTRUCTIONS:
+                    pending = col
+            elif compiler.checkLabel(i):
+                try:
+                    c = int(i[1:], 16)
+                except ValueError:
+                    diagnostics.append((col, CompilerError.LabelError,
+                                        compiler.counter))
+                    continue
+                segments.append((col, compiler.counter, c, []))
+                compiler.counter = c
+            else:
+                diagnostics.append((col, CompilerError.InstructionError,
+                                    compiler.counter))
+        # Split the emitted cells into the runs started by each label.
+        cells = compiler.mem_dict
+        for n, (col, before, start, values) in enumerate(segments):
+            stop = segments[n + 1][1] if n + 1 < len(segments) \
+                else compiler.counter
+            values.extend(cells[a] for a in range(start, stop))
+        first = next((start for _, _, start, values in segments if values),
+                     compiler.counter)
+        return LineResult(first, compiler.counter, pending, segments,
+                          diagnostics)
+
+    @staticmethod
+    def state(results: list, row: int):
+        """The (address, pending) row starts in."""
+        if row == 0:
+            return 0, False
+        result = results[row - 1]
+        return result.end, result.pending is not None
+
+    @staticmethod
+    def marks(result: LineResult):
+        """Whether merge has to look at the line."""
+        return bool(result.diagnostics or result.pending or
+                    len(result.segments) > 1)
+
+    @staticmethod
+    def relocate(result: LineResult, offset: int):
+        """The result of a line without labels moved by offset cells."""
+        (col, before, start, values), = result.segments
+        return LineResult(result.address + offset, result.end + offset,
+                          result.pending,
+                          [(col, before + offset, start + offset, values)],
+                          [(c, error, address + offset) for c, error, address
+                           in result.diagnostics])
+
+    def update(self, lines):
+        """Brings the line results up to date with lines, a list."""
+        texts = self.texts
+        limit = min(len(lines), len(texts))
+        prefix = 0
+        while prefix < limit and lines[prefix] == texts[prefix]:
+            prefix += 1
+        suffix = 0
+        while suffix < limit - prefix and \
+                lines[-1 - suffix] == texts[-1 - suffix]:
+            suffix += 1
+        self.replace(prefix, len(texts) - suffix - prefix,
+                     lines[prefix:len(lines) - suffix])
+
+    def replace(self, row: int, count: int, lines):
+        """Replaces the count lines from row with lines, a list."""
+        texts = self.texts
+        old = self.results
+        texts[row:row + count] = lines
+        shift = len(lines) - count
+        stop = row + len(lines)
+        results = []
+        address, pending = self.state(old, row)
+        end = row
+        while end < len(texts):
+            result = None
+            if end >= stop:
+                # An unchanged line; once it starts as it did before,
+                # so does everything after it.
+                before = self.state(old, end - shift)
+                if before == (address, pending):
+                    break
+                result = old[end - shift]
+                if before[1] == pending and len(result.segments) == 1:
+                    result = self.relocate(result, address - before[0])
+                else:
+                    result = None
+            if result is None:
+                result = self.assemble_line(texts[end], address, pending)
+                self.assembled += 1
+            results.append(result)
+            address = result.end
+            pending = result.pending is not None
+            end += 1
+        old[row:end - shift] = results
+        marked = self.marked
+        first = bisect_left(marked, row)
+        last = bisect_left(marked, end - shift)
+        fresh = [r for r in range(row, end) if self.marks(old[r])]
+        marked[first:last] = fresh
+        if shift:
+            for i in range(first + len(fresh), len(marked)):
+                marked[i] += shift
+        self.merge()
+
+    def merge(self):
+        errors = dict()
+        runs = []
+        run = 0
+        pending_at = None
+        for row in self.marked:
+            result = self.results[row]
+            found = result.diagnostics
+            for col, before, start, values in result.segments[1:]:
+                runs.append((run, before))
+                run = start
+                if any(a <= start < b for a, b in runs):
+                    found = found + [(col, CompilerError.LabelError, before)]
+            if found:
+                errors[row] = sorted(found, key=lambda d: d[0])
+            if result.pending:
+                pending_at = (row, result.pending)
+        self.end = self.results[-1].end if self.results else 0
+        if self.results and self.results[-1].pending is not None and \
+                pending_at is not None:
+            # Nothing followed the last instruction to be its argument.
+            row, col = pending_at
+            errors.setdefault(row, []).append(
+                (col, CompilerError.ArgumentError, self.end))
+        self.errors = errors
+        self.first_error = None
+        if errors:
+            row = min(errors)
+            col, error, address = errors[row][0]
+            self.first_error = (row, col, error, address)
+
+    def diagnostics(self, row: int):
+        return self.errors.get(row, [])
+
+    def address(self, row: int):
+        if row < len(self.results):
+            return self.results[row].address
+        return self.end
+
+    def error(self):
+        """Returns the error Compiler would report with its (line, col)."""
+        if self.first_error is not None:
+            row, col, error, address = self.first_error
+            if address >= self.size:
+                return CompilerError.MaxInstructionsError, None
+            return error, (row + 1, col)
+        if self.end >= self.size:
+            return CompilerError.MaxInstructionsError, None
+        return CompilerError.NoError, None
+
+    def image(self):
+        error, _ = self.error()
+        if error != CompilerError.NoError:
+            return [], error
+        image = [0] * self.size
+        for result in self.results:
+            for _, _, start, values in result.segments:
+                if start < 0:
+                    # Compiler drops the cells below address 0.
+                    values = values[-start:]
+                    start = 0
+                if start < self.size:
+                    image[start:start + len(values)] = \
+                        values[:self.size - start]
+        return image, error
+
+
 if __name__ == '__main__':
     txt = "#0A\nMOVLA AB\nOUTA\nHALT\n#0E\nMOVLA BA\nOUTA\nHALT"
     compiler = Compiler(txt.split())
     l, e = compiler.compile()
     print(l)
     print(e.name)
+    compiler = Compiler.from_lines(txt.splitlines())
+    compiler.compile()
+    print(compiler.positions)
+    compiler = Compiler("#0100 JMPL 0200".split(), 16, 8)
+    print(compiler.compile()[0][0x100:0x103])
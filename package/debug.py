@@ -0,0 +1,180 @@
+import operator
+from collections import namedtuple
+
+from package.mpu import Instructions
+
+OPERATORS = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<=': operator.le,
+    '>=': operator.ge,
+    '<': operator.lt,
+    '>': operator.gt,
+}
+
+# Values a condition can compare, read from the CPU and the current PC.
+OPERANDS = {
+    'A': lambda cpu, pc: cpu.reg_a.value,
+    'B': lambda cpu, pc: cpu.reg_b.value,
+    'OUT': lambda cpu, pc: cpu.reg_out.value,
+    'PC': lambda cpu, pc: pc,
+    'Z': lambda cpu, pc: int(cpu.zero),
+    'C': lambda cpu, pc: int(cpu.carry),
+}
+
+# Opcodes reading the RAM cell their operand points at, and the ones
+# reading a whole address from there.
+READS = frozenset(int(i.value, 16) for i in (
+    Instructions.OUTR, Instructions.MOVRA, Instructions.MOVRB))
+POINTER_READS = frozenset(int(i.value, 16) for i in (
+    Instructions.JMPR, Instructions.JZFR, Instructions.JCFR))
+WRITES = frozenset(int(i.value, 16) for i in (
+    Instructions.MOVAR, Instructions.MOVBR))
+
+Condition = namedtuple('Condition', ['text', 'left', 'compare', 'right'])
+
+
+def parse_operand(text: str):
+    if text.upper() in OPERANDS:
+        return OPERANDS[text.upper()]
+    value = int(text, 0)
+    return lambda cpu, pc: value
+
+
+def parse_condition(text: str):
+    """Parses '<operand> <operator> <operand>', like 'A > B' or
+    'OUT == 0x59'. Operands are A, B, OUT, PC, Z, C or a number."""
+    parts = text.split()
+    try:
+        left, symbol, right = parts
+        return Condition(text, parse_operand(left), OPERATORS[symbol],
+                         parse_operand(right))
+    except (KeyError, ValueError):
+        raise ValueError("Invalid Condition: " + text)
+
+
+class Debugger:
+    """Stops a running program at breakpoints and watchpoints.
+
+    Attach one to CPU.debugger. Breakpoints stop before the instruction
+    at an address runs, watchpoints before an instruction reads or writes
+    a watched RAM address, and conditions before an instruction at which
+    they start to hold, so a condition that stays true stops once. A stop
+    disables the CPU and describes itself in hit; re-enabling the CPU
+    resumes with the instruction that stopped it. Engines only switch to
+    a checking loop while something is set, which looks the PC and the
+    opcode up in sets and only calls check for instructions that may
+    stop.
+    """
+
+    def __init__(self):
+        self.pcs = set()
+        self.reads = set()
+        self.writes = set()
+        self.conditions = []
+        self.held = []
+        self.hit = None
+        self.resume = None
+
+    def active(self):
+        return bool(self.pcs or self.reads or self.writes or
+                    self.conditions)
+
+    def opcodes(self, count: int):
+        """The opcodes, of count, check must see wherever they run."""
+        if self.conditions:
+            return frozenset(range(count))
+        ops = frozenset()
+        if self.reads:
+            ops |= READS | POINTER_READS
+        if self.writes:
+            ops |= WRITES
+        return ops
+
+    def add(self, spec: str):
+        """Adds a breakpoint at a hex address or on a condition."""
+        try:
+            self.pcs.add(int(spec, 16))
+        except ValueError:
+            self.conditions.append(parse_condition(spec))
+            self.held.append(False)
+
+    def remove(self, spec: str):
+        try:
+            self.pcs.discard(int(spec, 16))
+        except ValueError:
+            kept = [(c, h) for c, h in zip(self.conditions, self.held)
+                    if c.text.split() != spec.split()]
+            self.conditions = [c for c, _ in kept]
+            self.held = [h for _, h in kept]
+
+    def watch(self, address: int, read: bool = True, write: bool = True):
+        if read:
+            self.reads.add(address)
+        if write:
+            self.writes.add(address)
+
+    def unwatch(self, address: int):
+        self.reads.discard(address)
+        self.writes.discard(address)
+
+    def clear_breaks(self):
+        self.pcs.clear()
+        self.conditions = []
+        self.held = []
+
+    def clear_watches(self):
+        self.reads.clear()
+        self.writes.clear()
+
+    def reset(self):
+        """Forgets the last stop, for a program started afresh."""
+        self.hit = None
+        self.resume = None
+        self.held = [False] * len(self.conditions)
+
+    def take_resume(self):
+        """The address to run without checking first, forgetting it."""
+        resume, self.resume = self.resume, None
+        return resume
+
+    def check(self, cpu, pc: int, op: int):
+        """Returns True, stopping the CPU, if the instruction at pc must
+        not run."""
+        hit = None
+        if pc in self.pcs:
+            hit = "BREAK " + format(pc, '02X')
+        elif op in WRITES and self.writes:
+            address = cpu.read_word((pc + 1) & cpu.pc.maxValue)
+            if address in self.writes:
+                hit = "WRITE {0:02X} AT {1:02X}".format(address, pc)
+        elif (op in READS or op in POINTER_READS) and self.reads:
+            address = cpu.read_word((pc + 1) & cpu.pc.maxValue)
+            cells = cpu.operand_cells if op in POINTER_READS else 1
+            for i in range(cells):
+                cell = (address + i) & cpu.pc.maxValue
+                if cell in self.reads:
+                    hit = "READ {0:02X} AT {1:02X}".format(cell, pc)
+                    break
+        held = self.held
+        for i, condition in enumerate(self.conditions):
+            holds = condition.compare(condition.left(cpu, pc),
+                                      condition.right(cpu, pc))
+            if holds and not held[i] and hit is None:
+                hit = condition.text
+            held[i] = holds
+        if hit is None:
+            return False
+        self.hit = hit
+        self.resume = pc
+        cpu.enable = False
+        return True
+
+    def report(self):
+        lines = ["BREAK " + format(pc, '02X') for pc in sorted(self.pcs)]
+        lines += ["BREAK " + c.text for c in self.conditions]
+        for address in sorted(self.reads | self.writes):
+            kind = ('R' if address in self.reads else '') + \
+                ('W' if address in self.writes else '')
+            lines.append("WATCH " + format(address, '02X') + " " + kind)
+        return lines
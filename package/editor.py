@@ -76,45 +76,82 @@ class Cursor:
 
 
 class Buffer:
+    """Lines of text held in a gap buffer.
+
+    The lines before the gap are kept in order in head and the lines after
+    it in reverse order in tail. Edits move the gap to the cursor row, so
+    inserting, splitting and joining lines only appends to and pops from
+    the ends of the two lists; moving the gap costs one pop and append per
+    row crossed.
+    """
+
     def __init__(self, lines):
-        self.lines = lines
+        self.head = list(lines)
+        self.tail = []
 
     def __len__(self):
-        return len(self.lines)
+        return len(self.head) + len(self.tail)
 
     def __getitem__(self, index):
-        return self.lines[index]
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if index < len(self.head):
+            return self.head[index]
+        if index >= len(self):
+            raise IndexError("Buffer index out of range")
+        return self.tail[len(self) - 1 - index]
 
     @ property
     def bottom(self):
-        return len(self.lines) - 1
+        return len(self) - 1
+
+    @ property
+    def lines(self):
+        return self.head + self.tail[::-1]
+
+    def move_gap(self, row):
+        head, tail = self.head, self.tail
+        while len(head) > row:
+            tail.append(head.pop())
+        while len(head) < row and tail:
+            head.append(tail.pop())
 
     def insert(self, cursor, string):
         row, col = cursor.row, cursor.col
-        if len(self.lines) != 0:
-            current = self.lines.pop(row)
+        if len(self) != 0:
+            self.move_gap(row + 1)
+            current = self.head.pop()
             new = current[:col] + string + current[col:]
         else:
             new = string
-        self.lines.insert(row, new)
+        self.head.append(new)
 
     def split(self, cursor):
         row, col = cursor.row, cursor.col
-        current = self.lines.pop(row) if (row, col) != (0, 0) else ""
-        self.lines.insert(row, current[:col])
-        self.lines.insert(row+1, current[col:])
+        if (row, col) != (0, 0):
+            self.move_gap(row + 1)
+            current = self.head.pop()
+        else:
+            self.move_gap(row)
+            current = ""
+        self.head.append(current[:col])
+        self.head.append(current[col:])
 
     def delete(self, cursor):
         row, col = cursor.row, cursor.col
-        if (row, col) < (self.bottom, len(self.lines[row])):
-            current = self.lines.pop(row)
+        if (row, col) < (self.bottom, len(self[row])):
+            self.move_gap(row + 1)
+            current = self.head.pop()
             if col < len(current):
                 new = current[:col] + current[col + 1:]
-                self.lines.insert(row, new)
             else:
-                next = self.lines.pop(row)
-                new = current + next
-                self.lines.insert(row, new)
+                new = current + self.tail.pop()
+            self.head.append(new)
+
+    def text(self):
+        return "\n".join(self.lines)
 
 
 def right(window, cursor, buffer):
@@ -130,23 +167,32 @@ def left(window, cursor, buffer):
 
 
 class Editor:
+    """Edits buffer in win until ESC is pressed.
 
-    def __init__(self, win: 'curses._CursesWindow', buffer=Buffer([])):
+    With an assembler, an IncrementalCompiler, the buffer is assembled
+    after every edit, lines with errors are underlined and the bottom row
+    shows the address of the cursor line and the first error.
+    """
+
+    def __init__(self, win: 'curses._CursesWindow', buffer=Buffer([]),
+                 assembler=None):
         self.win = win
         height, width = win.getmaxyx()
+        self.assembler = assembler
+        if assembler is not None:
+            height -= 1
+            assembler.update(buffer.lines)
         self.window = Window(height, width)
         self.cursor = Cursor()
         self.buffer = buffer
+        self.shown = [("", curses.A_NORMAL)] * height
+        self.status_shown = None
 
+        self.win.erase()
         while True:
-            self.win.erase()
-            for row, line in enumerate(self.buffer[self.window.row:self.window.n_rows+self.window.row]):
-                if row == self.cursor.row-self.window.row and self.window.col > 0:
-                    line = "<<"+line[self.window.col+1:]
-                if len(line) > self.window.n_cols:
-                    line = line[:self.window.n_cols-1]+">>"
-                win.addstr(row, 0, line)
-
+            self.draw()
+            if assembler is not None:
+                self.status()
             self.win.move(*self.window.translate(self.cursor))
 
             k = self.win.getch()
@@ -169,25 +215,81 @@ class Editor:
                 self.window.down(self.cursor, self.buffer)
                 self.window.horizontal_scroll(self.cursor)
             elif k == ascii.NL:
+                row, before = self.cursor.row, len(self.buffer)
                 self.buffer.split(self.cursor)
                 right(self.window, self.cursor, self.buffer)
+                self.edited(row, before)
             elif k == ascii.DEL:
                 r, c = self.cursor.row, self.cursor.col
                 if (r, c) == (0, 0):
                     pass
                 else:
                     left(self.window, self.cursor, self.buffer)
+                    row, before = self.cursor.row, len(self.buffer)
                     self.buffer.delete(self.cursor)
+                    self.edited(row, before)
             else:
+                row, before = self.cursor.row, len(self.buffer)
                 self.buffer.insert(self.cursor, chr(k))
                 for _ in chr(k):
                     right(self.window, self.cursor, self.buffer)
+                self.edited(row, before)
+
+    def edited(self, row: int, before: int):
+        """Hands the lines changed by an edit at row, when the buffer
+        held before lines, to the assembler.
+
+        An edit rewrites the line at row, if there was one, and a join
+        the line after it too; the lines it added or removed follow.
+        """
+        if self.assembler is not None:
+            added = len(self.buffer) - before
+            count = min(before - row, 1 - min(added, 0))
+            self.assembler.replace(row, count,
+                                   self.buffer[row:row + count + added])
+
+    def draw(self):
+        """Repaints the rows whose text differs from what is on screen.
+
+        shown holds the text last written to every row, so moving the
+        cursor within the visible lines writes nothing but the cursor.
+        """
+        window = self.window
+        for row in range(window.n_rows):
+            index = window.row + row
+            line = self.buffer[index] if index < len(self.buffer) else ""
+            if row == self.cursor.row-window.row and window.col > 0:
+                line = "<<"+line[window.col+1:]
+            if len(line) > window.n_cols-1:
+                line = line[:window.n_cols-3]+">>"
+            attr = curses.A_NORMAL
+            if self.assembler is not None and \
+                    self.assembler.diagnostics(index):
+                attr = curses.A_UNDERLINE
+            if self.shown[row] != (line, attr):
+                self.shown[row] = (line, attr)
+                self.win.move(row, 0)
+                self.win.clrtoeol()
+                self.win.addstr(row, 0, line, attr)
+
+    def status(self):
+        address = self.assembler.address(self.cursor.row)
+        text = "ADDR " + format(address, '02X')
+        error, position = self.assembler.error()
+        if error.value:
+            text += "  " + error.name
+            if position is not None:
+                text += " {0}:{1}".format(*position)
+        text = text[:self.window.n_cols-1]
+        if self.status_shown != text:
+            self.status_shown = text
+            row = self.window.n_rows
+            self.win.move(row, 0)
+            self.win.clrtoeol()
+            self.win.addstr(row, 0, text, curses.A_REVERSE)
 
     def getBuffer(self):
-        text = ""
-        for line in self.buffer.lines:
-            text += line+"\n"
-        return text.strip()
+        return self.buffer.text().strip()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,402 @@
+from package.blockcache import BlockCache
+from package.mpu import CPU, Instructions, Register
+
+
+class Interpreter:
+    def __init__(self, cpu: CPU):
+        self.cpu = cpu
+
+    def step(self):
+        self.cpu.step()
+
+    def run(self, max_cycles=None):
+        cpu = self.cpu
+        count = 0
+        while cpu.is_enabled():
+            if max_cycles is not None and count >= max_cycles:
+                break
+            if not cpu.step():
+                break
+            count += 1
+        return count
+
+
+class Dispatcher:
+    """Executes whole instructions through an opcode table.
+
+    Every handler is bound to the registers and memory of one CPU and
+    receives the address following the opcode cell, returning the address
+    of the next instruction. The table has an entry for every value a cell
+    can hold; opcodes missing from Instructions are bound to an explicit
+    handler which, like CPU.execute, does nothing.
+    """
+
+    def __init__(self, cpu: CPU):
+        self.cpu = cpu
+        self.table = self.build_table()
+
+    def build_table(self):
+        cpu = self.cpu
+        ram = cpu.ram_mem
+        mem = ram.memory
+        listeners = ram.listeners
+        reg_a = cpu.reg_a
+        reg_b = cpu.reg_b
+        reg_out = cpu.reg_out
+        amask = cpu.pc.maxValue
+        dmax = reg_a.maxValue
+
+        def store(register: Register, value: int):
+            if value > dmax:
+                value = value - dmax
+            register.value = value
+
+        def jump(address: int):
+            assert 0 <= address <= amask
+            return address
+
+        def out(value: int):
+            store(reg_out, value)
+            if cpu.out_history is not None:
+                cpu.out_history.append(reg_out.value)
+
+        def undefined(pc):
+            return pc
+
+        def halt(pc):
+            cpu.enable = False
+            return pc
+
+        def outl(pc):
+            out(mem[pc])
+            return (pc + 1) & amask
+
+        def outr(pc):
+            out(mem[mem[pc]])
+            return (pc + 1) & amask
+
+        def outa(pc):
+            out(reg_a.value)
+            return pc
+
+        def outb(pc):
+            out(reg_b.value)
+            return pc
+
+        def movla(pc):
+            store(reg_a, mem[pc])
+            return (pc + 1) & amask
+
+        def movlb(pc):
+            store(reg_b, mem[pc])
+            return (pc + 1) & amask
+
+        def movra(pc):
+            store(reg_a, mem[mem[pc]])
+            return (pc + 1) & amask
+
+        def movrb(pc):
+            store(reg_b, mem[mem[pc]])
+            return (pc + 1) & amask
+
+        def write(address: int, value: int):
+            if value > dmax:
+                value = value - dmax
+            mem[address] = value & dmax
+            if listeners:
+                ram.notify(address, address + 1)
+
+        def movar(pc):
+            write(mem[pc], reg_a.value)
+            return (pc + 1) & amask
+
+        def movbr(pc):
+            write(mem[pc], reg_b.value)
+            return (pc + 1) & amask
+
+        def adda(pc):
+            cpu.alu_result = num = reg_a.value + reg_b.value
+            store(reg_a, num)
+            return pc
+
+        def addb(pc):
+            cpu.alu_result = num = reg_a.value + reg_b.value
+            store(reg_b, num)
+            return pc
+
+        def subba(pc):
+            cpu.alu_result = num = reg_a.value - reg_b.value
+            store(reg_a, num)
+            return pc
+
+        def subab(pc):
+            cpu.alu_result = num = reg_b.value - reg_a.value
+            store(reg_b, num)
+            return pc
+
+        def anda(pc):
+            cpu.alu_result = num = reg_a.value & reg_b.value
+            store(reg_a, num)
+            return pc
+
+        def andb(pc):
+            cpu.alu_result = num = reg_a.value & reg_b.value
+            store(reg_b, num)
+            return pc
+
+        # ORA stores into B, exactly as CPU.execute does.
+        def ora(pc):
+            cpu.alu_result = num = reg_a.value | reg_b.value
+            store(reg_b, num)
+            return pc
+
+        def orb(pc):
+            cpu.alu_result = num = reg_a.value | reg_b.value
+            store(reg_b, num)
+            return pc
+
+        def jmpl(pc):
+            return jump(mem[pc])
+
+        def jmpr(pc):
+            return jump(mem[mem[pc]])
+
+        def jmpa(pc):
+            return jump(reg_a.value)
+
+        def jmpb(pc):
+            return jump(reg_b.value)
+
+        def jzfl(pc):
+            arg = mem[pc]
+            return jump(arg) if cpu.zero else (pc + 1) & amask
+
+        def jzfr(pc):
+            arg = mem[mem[pc]]
+            return jump(arg) if cpu.zero else (pc + 1) & amask
+
+        def jzfa(pc):
+            return jump(reg_a.value) if cpu.zero else pc
+
+        def jzfb(pc):
+            return jump(reg_b.value) if cpu.zero else pc
+
+        def jcfl(pc):
+            arg = mem[pc]
+            return jump(arg) if cpu.carry else (pc + 1) & amask
+
+        def jcfr(pc):
+            arg = mem[mem[pc]]
+            return jump(arg) if cpu.carry else (pc + 1) & amask
+
+        def jcfa(pc):
+            return jump(reg_a.value) if cpu.carry else pc
+
+        def jcfb(pc):
+            return jump(reg_b.value) if cpu.carry else pc
+
+        handlers = {
+            Instructions.HALT: halt,
+            Instructions.OUTL: outl,
+            Instructions.OUTR: outr,
+            Instructions.OUTA: outa,
+            Instructions.OUTB: outb,
+            Instructions.MOVLA: movla,
+            Instructions.MOVLB: movlb,
+            Instructions.MOVRA: movra,
+            Instructions.MOVRB: movrb,
+            Instructions.MOVAR: movar,
+            Instructions.MOVBR: movbr,
+            Instructions.ADDA: adda,
+            Instructions.ADDB: addb,
+            Instructions.SUBBA: subba,
+            Instructions.SUBAB: subab,
+            Instructions.ANDA: anda,
+            Instructions.ANDB: andb,
+            Instructions.ORA: ora,
+            Instructions.ORB: orb,
+            Instructions.JMPL: jmpl,
+            Instructions.JMPR: jmpr,
+            Instructions.JMPA: jmpa,
+            Instructions.JMPB: jmpb,
+            Instructions.JZFL: jzfl,
+            Instructions.JZFR: jzfr,
+            Instructions.JZFA: jzfa,
+            Instructions.JZFB: jzfb,
+            Instructions.JCFL: jcfl,
+            Instructions.JCFR: jcfr,
+            Instructions.JCFA: jcfa,
+            Instructions.JCFB: jcfb,
+        }
+        if cpu.operand_cells > 1:
+            handlers.update(self.wide_handlers(out, store, write, jump))
+        table = [undefined] * (dmax + 1)
+        for instruction, handler in handlers.items():
+            table[int(instruction.value, 16)] = handler
+        return table
+
+    def wide_handlers(self, out, store, write, jump):
+        """Handlers for the instructions taking an operand on machines
+        where an operand spans several cells, low cell first."""
+        cpu = self.cpu
+        mem = cpu.ram_mem.memory
+        reg_a = cpu.reg_a
+        reg_b = cpu.reg_b
+        amask = cpu.pc.maxValue
+        cells = cpu.operand_cells
+        shift = cpu.ram_mem.dataWidth.value
+
+        def word(address: int):
+            value = 0
+            for i in range(cells):
+                value |= mem[(address + i) & amask] << (i * shift)
+            return value
+
+        def operand(action, indirect: bool = False):
+            def handler(pc):
+                arg = word(pc)
+                action(mem[arg] if indirect else arg)
+                return (pc + cells) & amask
+            return handler
+
+        def branch(taken, indirect: bool = False):
+            def handler(pc):
+                arg = word(pc)
+                if indirect:
+                    arg = word(arg)
+                return jump(arg) if taken() else (pc + cells) & amask
+            return handler
+
+        def always():
+            return True
+
+        return {
+            Instructions.OUTL: operand(out),
+            Instructions.OUTR: operand(out, True),
+            Instructions.MOVLA: operand(lambda v: store(reg_a, v)),
+            Instructions.MOVLB: operand(lambda v: store(reg_b, v)),
+            Instructions.MOVRA: operand(lambda v: store(reg_a, v), True),
+            Instructions.MOVRB: operand(lambda v: store(reg_b, v), True),
+            Instructions.MOVAR: operand(lambda a: write(a, reg_a.value)),
+            Instructions.MOVBR: operand(lambda a: write(a, reg_b.value)),
+            Instructions.JMPL: branch(always),
+            Instructions.JMPR: branch(always, True),
+            Instructions.JZFL: branch(lambda: cpu.zero),
+            Instructions.JZFR: branch(lambda: cpu.zero, True),
+            Instructions.JCFL: branch(lambda: cpu.carry),
+            Instructions.JCFR: branch(lambda: cpu.carry, True),
+        }
+
+    def step(self):
+        cpu = self.cpu
+        op = cpu.ram_mem.memory[cpu.pc.value]
+        if cpu.stops_at(cpu.pc.value, op):
+            return
+        record = cpu.observer()
+        if record is not None:
+            record(cpu, cpu.pc.value, op)
+        cpu.pc.inc_counter()
+        cpu.pc.value = self.table[op](cpu.pc.value)
+
+    def run(self, max_cycles=None):
+        cpu = self.cpu
+        record = cpu.observer()
+        debugger = cpu.debugger
+        if debugger is not None:
+            if debugger.active():
+                return self.run_checked(record, max_cycles)
+            # Nothing can stop the instruction a resume would skip.
+            debugger.take_resume()
+        if record is not None:
+            return self.run_profiled(record, max_cycles)
+        counter = cpu.pc
+        mem = cpu.ram_mem.memory
+        table = self.table
+        amask = counter.maxValue
+        pc = counter.value
+        count = 0
+        try:
+            while cpu.enable:
+                if max_cycles is not None and count >= max_cycles:
+                    break
+                op = mem[pc]
+                pc = (pc + 1) & amask
+                pc = table[op](pc)
+                count += 1
+        finally:
+            counter.value = pc
+        return count
+
+    def run_profiled(self, record, max_cycles=None):
+        cpu = self.cpu
+        counter = cpu.pc
+        mem = cpu.ram_mem.memory
+        table = self.table
+        amask = counter.maxValue
+        pc = counter.value
+        count = 0
+        try:
+            while cpu.enable:
+                if max_cycles is not None and count >= max_cycles:
+                    break
+                op = mem[pc]
+                record(cpu, pc, op)
+                pc = (pc + 1) & amask
+                pc = table[op](pc)
+                count += 1
+        finally:
+            counter.value = pc
+        return count
+
+    def run_checked(self, record, max_cycles=None):
+        cpu = self.cpu
+        debugger = cpu.debugger
+        check = debugger.check
+        pcs = debugger.pcs
+        ops = debugger.opcodes(len(self.table))
+        skip = debugger.take_resume()
+        counter = cpu.pc
+        mem = cpu.ram_mem.memory
+        table = self.table
+        amask = counter.maxValue
+        pc = counter.value
+        count = 0
+        try:
+            while cpu.enable:
+                if max_cycles is not None and count >= max_cycles:
+                    break
+                op = mem[pc]
+                if (pc in pcs or op in ops) and pc != skip and \
+                        check(cpu, pc, op):
+                    break
+                skip = None
+                if record is not None:
+                    record(cpu, pc, op)
+                pc = (pc + 1) & amask
+                pc = table[op](pc)
+                count += 1
+        finally:
+            counter.value = pc
+        return count
+
+
+ENGINES = {
+    'interp': Interpreter,
+    'dispatch': Dispatcher,
+    'block': BlockCache,
+}
+
+
+def create_engine(cpu: CPU, name: str = 'dispatch'):
+    if name not in ENGINES:
+        raise ValueError("Unknown Engine: " + name)
+    return ENGINES[name](cpu)
+
+
+if __name__ == '__main__':
+    cpu = CPU()
+    cpu.set_instructions([17, 0, 18, 1, 33, 97, 9, 65, 4, 0])
+    cpu.set_enabled(True)
+    engine = create_engine(cpu)
+    print(engine.run(30000))
+    print(cpu)
@@ -0,0 +1,219 @@
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from package.cache import CompileCache
+from package.compiler import Compiler, CompilerError
+from package.engine import ENGINES, create_engine
+from package.loops import LoopDetector
+from package.mpu import CPU, PROFILES
+
+# Instructions run before the first check of the wall-time budget; later
+# runs are resized so a check comes about every CHECK seconds, or a tenth
+# of the budget if that is shorter, whatever the speed of the engine.
+CHUNK = 1000
+CHECK = 0.05
+
+# One compile cache per cache directory and machine in every worker process.
+caches = dict()
+
+
+def get_cache(directory: str = None, machine: str = 'mpu8'):
+    cache = caches.get((directory, machine))
+    if cache is None:
+        address_width, data_width = PROFILES[machine]
+        cache = caches[directory, machine] = CompileCache(
+            directory=directory, address_bits=address_width.value,
+            data_bits=data_width.value)
+    return cache
+
+
+def find_programs(directory: str):
+    programs = []
+    for root, _, files in os.walk(directory):
+        for name in files:
+            if name.endswith('.asm'):
+                programs.append(os.path.join(root, name))
+    return sorted(programs)
+
+
+def load_expected(path: str):
+    """Reads the expectations stored next to prog.asm in prog.json.
+
+    The file may hold "out", the list of values written to OUT, "ram",
+    a mapping of hex start address to the bytes expected there, and
+    "cycles"/"timeout" overriding the budgets for this program.
+    """
+    expected = os.path.splitext(path)[0] + '.json'
+    if not os.path.exists(expected):
+        return {}
+    with open(expected) as f:
+        return json.load(f)
+
+
+def check(cpu: CPU, expected: dict):
+    if 'out' in expected and cpu.out_history != expected['out']:
+        return "OUT " + str(cpu.out_history) + " != " + str(expected['out'])
+    for start, values in expected.get('ram', {}).items():
+        addr = int(start, 16)
+        actual = list(cpu.ram_mem.view(addr, addr + len(values)))
+        if actual != values:
+            return "RAM " + start + " " + str(actual) + " != " + str(values)
+    return None
+
+
+def run_program(path: str, max_cycles: int, timeout: float,
+                engine: str = 'dispatch', cache_dir: str = None,
+                loops: bool = False, machine: str = 'mpu8'):
+    start = time.perf_counter()
+    result = {'program': path, 'status': 'pass', 'cycles': 0,
+              'message': ''}
+    try:
+        expected = load_expected(path)
+        max_cycles = expected.get('cycles', max_cycles)
+        timeout = expected.get('timeout', timeout)
+        with open(path) as f:
+            source = f.read()
+        cache = get_cache(cache_dir, machine)
+        image, error = cache.compile(source)
+        if error != CompilerError.NoError:
+            result['status'] = 'error'
+            result['message'] = error.name
+            # Only failed programs are assembled again to locate the error.
+            compiler = Compiler.from_lines(source.splitlines(),
+                                           cache.address_bits,
+                                           cache.data_bits)
+            compiler.compile()
+            token = compiler.error_token
+            if token is not None:
+                result['message'] += " at {0}:{1}".format(token.line,
+                                                          token.col)
+            return result
+
+        cpu = CPU.from_profile(machine)
+        cpu.set_instructions(image)
+        cpu.out_history = []
+        cpu.set_enabled(True)
+        if loops:
+            cpu.detector = LoopDetector(cpu)
+        runner = create_engine(cpu, engine)
+        cycles = 0
+        chunk = CHUNK
+        interval = min(CHECK, timeout / 10)
+        while cpu.is_enabled() and cycles < max_cycles:
+            began = time.perf_counter()
+            cycles += runner.run(min(chunk, max_cycles - cycles))
+            now = time.perf_counter()
+            if now - start > timeout:
+                break
+            if now - began < interval / 2:
+                chunk *= 2
+            elif now - began > interval * 2 and chunk > 1:
+                chunk //= 2
+        result['cycles'] = cycles
+
+        if cpu.detector is not None and cpu.detector.loop is not None:
+            result['status'] = 'loop'
+            result['message'] = cpu.detector.report()
+        elif cpu.is_enabled():
+            result['status'] = 'timeout' if cycles < max_cycles \
+                else 'budget'
+        else:
+            message = check(cpu, expected)
+            if message is not None:
+                result['status'] = 'fail'
+                result['message'] = message
+    except Exception as e:
+        result['status'] = 'error'
+        result['message'] = type(e).__name__ + ": " + str(e)
+    finally:
+        result['elapsed'] = time.perf_counter() - start
+    return result
+
+
+def run_corpus(programs: list, max_cycles: int, timeout: float,
+               engine: str = 'dispatch', jobs: int = None,
+               cache_dir: str = None, loops: bool = False,
+               machine: str = 'mpu8'):
+    """Runs programs over a process pool, yielding results as they finish."""
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(run_program, path, max_cycles, timeout,
+                               engine, cache_dir, loops, machine)
+                   for path in programs]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def summarize(results: list, elapsed: float):
+    counts = {}
+    for r in results:
+        counts[r['status']] = counts.get(r['status'], 0) + 1
+    cycles = sum(r['cycles'] for r in results)
+    return {
+        'programs': len(results),
+        'counts': counts,
+        'cycles': cycles,
+        'elapsed': elapsed,
+        'programs_per_second': len(results) / elapsed if elapsed else 0.0,
+        'instructions_per_second': cycles / elapsed if elapsed else 0.0,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m package.harness',
+        description="Run a directory of programs against their "
+                    "expected results on all cores.")
+    parser.add_argument('directory')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help="worker processes, defaults to the core count")
+    parser.add_argument('-c', '--cycles', type=int, default=1000000,
+                        help="instruction budget per program")
+    parser.add_argument('-t', '--timeout', type=float, default=10.0,
+                        help="wall-time budget per program in seconds")
+    parser.add_argument('-e', '--engine', choices=sorted(ENGINES),
+                        default='dispatch')
+    parser.add_argument('-m', '--machine', choices=sorted(PROFILES),
+                        default='mpu8')
+    parser.add_argument('-l', '--loops', action='store_true',
+                        help="stop programs revisiting a state early and "
+                             "report their loop")
+    parser.add_argument('--json', action='store_true',
+                        help="print results and summary as JSON lines")
+    parser.add_argument('--cache', metavar='DIR',
+                        help="share assembled images through this directory")
+    args = parser.parse_args(argv)
+
+    programs = find_programs(args.directory)
+    results = []
+    start = time.perf_counter()
+    for result in run_corpus(programs, args.cycles, args.timeout,
+                             args.engine, args.jobs, args.cache,
+                             args.loops, args.machine):
+        results.append(result)
+        if args.json:
+            print(json.dumps(result), flush=True)
+        else:
+            print(result['status'].upper().ljust(8) + result['program'] +
+                  ("  " + result['message'] if result['message'] else ""),
+                  flush=True)
+    summary = summarize(results, time.perf_counter() - start)
+    if args.json:
+        print(json.dumps(summary))
+    else:
+        print("{0} programs in {1:.2f}s ({2:.1f} programs/s, "
+              "{3:.0f} instructions/s): {4}".format(
+                  summary['programs'], summary['elapsed'],
+                  summary['programs_per_second'],
+                  summary['instructions_per_second'],
+                  ", ".join(k + " " + str(v)
+                            for k, v in sorted(summary['counts'].items()))))
+    passed = summary['counts'].get('pass', 0)
+    return 0 if passed == summary['programs'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,189 @@
+import struct
+from collections import deque
+
+from package.engine import Dispatcher
+from package.mpu import CPU, Instructions
+
+MOVAR = int(Instructions.MOVAR.value, 16)
+MOVBR = int(Instructions.MOVBR.value, 16)
+
+# Bits of the delta mask, one per field of History.state plus RAM.
+FIELDS = 6
+RAM_BIT = 1 << FIELDS
+
+MASK = struct.Struct('<B')
+VALUE = struct.Struct('<q')
+RAM = struct.Struct('<qq')
+
+# Rough per-entry cost of a bytes object in a deque, added to its length.
+OVERHEAD = 48
+
+
+class History:
+    """Records every executed instruction so the CPU can step backwards.
+
+    Each instruction leaves a delta holding the old value of every field
+    it changed and, for MOVAR/MOVBR, the old value of the byte it wrote,
+    so stepping back is proportional to the delta rather than to the
+    distance from reset. Every interval instructions a full snapshot is
+    kept as well. Once limit bytes are in use the oldest deltas are
+    dropped; going back further than the oldest delta restores the
+    nearest older snapshot and re-executes forward from it.
+    """
+
+    def __init__(self, cpu: CPU, limit: int = 1 << 20, interval: int = 4096):
+        self.cpu = cpu
+        self.limit = limit
+        self.interval = interval
+        self.deltas = deque()
+        self.snapshots = deque()
+        self.delta_bytes = 0
+        self.snapshot_bytes = 0
+        self.count = 0
+        self.pending = None
+
+    def clear(self):
+        self.deltas.clear()
+        self.snapshots.clear()
+        self.delta_bytes = 0
+        self.snapshot_bytes = 0
+        self.count = 0
+        self.pending = None
+
+    @property
+    def oldest(self):
+        return self.count - len(self.deltas)
+
+    def state(self):
+        cpu = self.cpu
+        return (cpu.pc.value, cpu.reg_a.value, cpu.reg_b.value,
+                cpu.reg_out.value, cpu.reg_cz.value,
+                cpu.carry | (cpu.zero << 1) | (cpu.enable << 2))
+
+    def set_state(self, state: tuple):
+        cpu = self.cpu
+        (cpu.pc.value, cpu.reg_a.value, cpu.reg_b.value,
+         cpu.reg_out.value, cpu.reg_cz.value, flags) = state
+        cpu.carry = bool(flags & 1)
+        cpu.zero = bool(flags & 2)
+        cpu.enable = bool(flags & 4)
+        cpu.phase = 0
+
+    def begin(self):
+        """Remembers the state before the instruction about to run."""
+        cpu = self.cpu
+        if self.count % self.interval == 0 and \
+                (not self.snapshots or self.snapshots[-1][0] != self.count):
+            self.snapshots.append((self.count, cpu.snapshot()))
+            self.snapshot_bytes += len(self.snapshots[-1][1]) + OVERHEAD
+        mem = cpu.ram_mem.memory
+        pc = cpu.pc.value
+        address = None
+        if mem[pc] == MOVAR or mem[pc] == MOVBR:
+            address = cpu.read_word((pc + 1) & cpu.pc.maxValue)
+        self.pending = (self.state(), address,
+                        None if address is None else mem[address])
+
+    def commit(self):
+        """Stores the delta of the instruction started by begin."""
+        before, address, old = self.pending
+        self.pending = None
+        after = self.state()
+        mask = 0
+        values = []
+        for i in range(FIELDS):
+            if before[i] != after[i]:
+                mask |= 1 << i
+                values.append(VALUE.pack(before[i]))
+        if address is not None and self.cpu.ram_mem.memory[address] != old:
+            mask |= RAM_BIT
+            values.append(RAM.pack(address, old))
+        delta = MASK.pack(mask) + b''.join(values)
+        self.deltas.append(delta)
+        self.delta_bytes += len(delta) + OVERHEAD
+        self.count += 1
+        self.trim()
+
+    def trim(self):
+        while self.delta_bytes + self.snapshot_bytes > self.limit:
+            if len(self.snapshots) > 1 and \
+                    self.snapshot_bytes * 4 > self.limit:
+                _, blob = self.snapshots.popleft()
+                self.snapshot_bytes -= len(blob) + OVERHEAD
+            elif self.deltas:
+                self.delta_bytes -= len(self.deltas.popleft()) + OVERHEAD
+            else:
+                break
+
+    def cancel(self):
+        """Forgets the instruction started by begin, which did not run."""
+        self.pending = None
+
+    def step(self):
+        self.begin()
+        if self.cpu.step():
+            self.commit()
+        else:
+            self.cancel()
+
+    def undo(self):
+        cpu = self.cpu
+        delta = self.deltas.pop()
+        self.delta_bytes -= len(delta) + OVERHEAD
+        self.count -= 1
+        state = list(self.state())
+        mask, = MASK.unpack_from(delta)
+        offset = MASK.size
+        for i in range(FIELDS):
+            if mask & (1 << i):
+                state[i], = VALUE.unpack_from(delta, offset)
+                offset += VALUE.size
+        self.set_state(tuple(state))
+        if mask & RAM_BIT:
+            address, old = RAM.unpack_from(delta, offset)
+            cpu.ram_mem.memory[address] = old
+            if cpu.ram_mem.listeners:
+                cpu.ram_mem.notify(address, address + 1)
+        while self.snapshots and self.snapshots[-1][0] > self.count:
+            _, blob = self.snapshots.pop()
+            self.snapshot_bytes -= len(blob) + OVERHEAD
+
+    def back(self, n: int = 1):
+        """Steps back n instructions, returning how many were undone."""
+        done = 0
+        if self.pending is not None and n > 0:
+            self.set_state(self.pending[0])
+            self.pending = None
+            done += 1
+        target = max(self.count - (n - done), 0)
+        if target < self.oldest:
+            snapshots = [s for s in self.snapshots if s[0] <= target]
+            if not snapshots:
+                target = self.oldest
+            else:
+                index, blob = snapshots[-1]
+                return done + self.replay(index, blob, target)
+        while self.count > target:
+            self.undo()
+            done += 1
+        return done
+
+    def replay(self, index: int, blob: bytes, target: int):
+        steps = self.count - target
+        cpu = self.cpu
+        cpu.restore(blob)
+        # These instructions already ran, so no hook may see them again.
+        hooks = (cpu.debugger, cpu.profiler, cpu.tracer, cpu.detector)
+        cpu.debugger = cpu.profiler = cpu.tracer = cpu.detector = None
+        try:
+            ran = Dispatcher(cpu).run(target - index)
+        finally:
+            cpu.debugger, cpu.profiler, cpu.tracer, cpu.detector = hooks
+        assert ran == target - index
+        self.deltas.clear()
+        self.delta_bytes = 0
+        while self.snapshots and self.snapshots[-1][0] > target:
+            _, s = self.snapshots.pop()
+            self.snapshot_bytes -= len(s) + OVERHEAD
+        self.count = target
+        return steps
@@ -0,0 +1,122 @@
+import mmap
+import os
+
+# Files with these extensions are read and written as Intel HEX, anything
+# else as a raw binary image starting at address 0.
+HEX_EXTENSIONS = ('.hex', '.ihx')
+
+DATA, END, SEGMENT, START_SEGMENT, LINEAR, START_LINEAR = range(6)
+
+RECORD_LENGTH = 16
+
+
+def is_hex(path: str):
+    return os.path.splitext(path)[1].lower() in HEX_EXTENSIONS
+
+
+def checksum(record: bytes):
+    return -sum(record) & 0xFF
+
+
+def record(kind: int, address: int, data: bytes = b''):
+    body = bytes([len(data), address >> 8 & 0xFF, address & 0xFF, kind])
+    body += data
+    return ':' + (body + bytes([checksum(body)])).hex().upper()
+
+
+def parse_hex(lines):
+    """Yields (address, data) for every data record of an Intel HEX file."""
+    base = 0
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            if line[0] != ':':
+                raise ValueError
+            body = bytes.fromhex(line[1:])
+        except ValueError:
+            raise RuntimeError("Invalid HEX Record: line " + str(number))
+        if len(body) < 5 or len(body) != body[0] + 5 or \
+                checksum(body[:-1]) != body[-1]:
+            raise RuntimeError("Invalid HEX Record: line " + str(number))
+        address = body[1] << 8 | body[2]
+        kind = body[3]
+        data = body[4:-1]
+        if kind == DATA:
+            yield base + address, data
+        elif kind == END:
+            return
+        elif kind == SEGMENT:
+            base = int.from_bytes(data, 'big') << 4
+        elif kind == LINEAR:
+            base = int.from_bytes(data, 'big') << 16
+        elif kind not in (START_SEGMENT, START_LINEAR):
+            raise RuntimeError("Invalid HEX Record: line " + str(number))
+
+
+def format_hex(memory, sparse: bool = False):
+    """Returns the lines of an Intel HEX file holding memory.
+
+    A sparse file leaves out every record whose bytes are all zero.
+    """
+    lines = []
+    upper = 0
+    for address in range(0, len(memory), RECORD_LENGTH):
+        data = bytes(memory[address:address + RECORD_LENGTH])
+        if sparse and not any(data):
+            continue
+        if address >> 16 != upper:
+            upper = address >> 16
+            lines.append(record(LINEAR, 0, upper.to_bytes(2, 'big')))
+        lines.append(record(DATA, address & 0xFFFF, data))
+    lines.append(record(END, 0))
+    return lines
+
+
+def load_image(ram, path: str):
+    """Replaces the contents of ram with the image stored at path.
+
+    Raw images are mapped with mmap and copied straight into RAM; the
+    bytes missing at the end of a short image are cleared. Cells wider
+    than a byte are stored little-endian and HEX addresses count bytes.
+    """
+    if is_hex(path):
+        with open(path) as f:
+            segments = list(parse_hex(f))
+        # Every record is checked before RAM is touched.
+        image = bytearray(len(ram.memory) * ram.itemsize)
+        for address, data in segments:
+            if address % ram.itemsize or address + len(data) > len(image):
+                raise RuntimeError("Invalid Address: " + hex(address))
+            image[address:address + len(data)] = data
+        ram.load_bytes(image)
+        return
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size > len(ram.memory) * ram.itemsize:
+            raise RuntimeError("Image Too Large: " + str(size) + " bytes")
+        ram.clear()
+        if size % ram.itemsize:
+            # A sparse image may end inside its last cell.
+            data = f.read()
+            ram.load_bytes(data + bytes(-size % ram.itemsize))
+        elif size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                ram.load_bytes(data)
+
+
+def save_image(ram, path: str, sparse: bool = False):
+    """Writes ram to path, as Intel HEX or raw binary by its extension.
+
+    A sparse raw image stops after the last non-zero byte.
+    """
+    data = ram.dump()
+    if is_hex(path):
+        with open(path, 'w') as f:
+            f.write("\n".join(format_hex(data, sparse)) + "\n")
+        return
+    if sparse:
+        data = data.rstrip(b'\0')
+    with open(path, 'wb') as f:
+        f.write(data)
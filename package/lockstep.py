@@ -0,0 +1,238 @@
+import numpy as np
+
+from package.mpu import CPU, Instructions
+
+
+class Lockstep:
+    """Runs many copies of one machine in lockstep on NumPy arrays.
+
+    Every lane has its own PC, registers, flags and 256 bytes of memory.
+    Each step reads the opcode under every running lane's PC and applies
+    each distinct opcode to the lanes that fetched it, so lanes may
+    diverge freely. A lane stops on HALT, recording the step at which it
+    halted, or on a jump outside the address space, which the scalar
+    engines report with an AssertionError and which is recorded here in
+    fault.
+    """
+
+    def __init__(self, image, lanes: int):
+        self.lanes = lanes
+        self.amask = 255
+        self.dmax = 255
+        self.mem = np.zeros((lanes, self.amask + 1), dtype=np.uint8)
+        data = np.array([(c - self.dmax if c > self.dmax else c) & self.dmax
+                         for c in image[:self.amask + 1]], dtype=np.uint8)
+        self.mem[:, :len(data)] = data
+        self.pc = np.zeros(lanes, dtype=np.int64)
+        self.a = np.zeros(lanes, dtype=np.int64)
+        self.b = np.zeros(lanes, dtype=np.int64)
+        self.out = np.zeros(lanes, dtype=np.int64)
+        self.cz = np.zeros(lanes, dtype=np.int64)
+        self.zero = np.zeros(lanes, dtype=bool)
+        self.carry = np.zeros(lanes, dtype=bool)
+        self.enable = np.ones(lanes, dtype=bool)
+        self.fault = np.zeros(lanes, dtype=bool)
+        self.halt_cycle = np.full(lanes, -1, dtype=np.int64)
+        self.cycle = 0
+        self.table = self.build_table()
+
+    def store(self, register: np.ndarray, lanes, value):
+        register[lanes] = np.where(value > self.dmax, value - self.dmax,
+                                   value)
+
+    def flags(self, lanes, num):
+        self.zero[lanes] = num == 0
+        self.carry[lanes] = num > 255
+        self.cz[lanes] = (self.carry[lanes].astype(np.int64) << 1) | \
+            self.zero[lanes]
+
+    def jump(self, lanes, after, target):
+        good = (target >= 0) & (target <= self.amask)
+        self.pc[lanes] = np.where(good, target, after)
+        bad = lanes[~good]
+        self.fault[bad] = True
+        self.enable[bad] = False
+
+    def build_table(self):
+        mem = self.mem
+        a = self.a
+        b = self.b
+        amask = self.amask
+
+        def nxt(pc):
+            return (pc + 1) & amask
+
+        def undefined(lanes, pc, arg):
+            self.pc[lanes] = pc
+
+        def halt(lanes, pc, arg):
+            self.pc[lanes] = pc
+            self.enable[lanes] = False
+            self.halt_cycle[lanes] = self.cycle + 1
+
+        def out(lanes, value):
+            self.store(self.out, lanes, value)
+
+        def outl(lanes, pc, arg):
+            out(lanes, arg)
+            self.pc[lanes] = nxt(pc)
+
+        def outr(lanes, pc, arg):
+            out(lanes, mem[lanes, arg])
+            self.pc[lanes] = nxt(pc)
+
+        def outa(lanes, pc, arg):
+            out(lanes, a[lanes])
+            self.pc[lanes] = pc
+
+        def outb(lanes, pc, arg):
+            out(lanes, b[lanes])
+            self.pc[lanes] = pc
+
+        def load(register, literal):
+            def handler(lanes, pc, arg):
+                value = arg if literal else mem[lanes, arg]
+                self.store(register, lanes, value.astype(np.int64))
+                self.pc[lanes] = nxt(pc)
+            return handler
+
+        def save(register):
+            def handler(lanes, pc, arg):
+                value = register[lanes]
+                value = np.where(value > self.dmax, value - self.dmax, value)
+                mem[lanes, arg] = value & self.dmax
+                self.pc[lanes] = nxt(pc)
+            return handler
+
+        def alu(dest, op):
+            def handler(lanes, pc, arg):
+                num = op(a[lanes], b[lanes])
+                self.store(dest, lanes, num)
+                self.flags(lanes, num)
+                self.pc[lanes] = pc
+            return handler
+
+        def jmp(source):
+            def handler(lanes, pc, arg):
+                if source == 'L':
+                    self.pc[lanes] = arg
+                elif source == 'R':
+                    self.pc[lanes] = mem[lanes, arg]
+                else:
+                    self.jump(lanes, pc, (a if source == 'A' else b)[lanes])
+            return handler
+
+        def branch(flag, source):
+            def handler(lanes, pc, arg):
+                taken = flag[lanes]
+                if source in ('L', 'R'):
+                    after = nxt(pc)
+                    target = arg if source == 'L' else mem[lanes, arg]
+                    self.pc[lanes] = np.where(taken, target, after)
+                else:
+                    self.pc[lanes] = pc
+                    lanes = lanes[taken]
+                    value = (a if source == 'A' else b)[lanes]
+                    self.jump(lanes, pc[taken], value)
+            return handler
+
+        handlers = {
+            Instructions.HALT: halt,
+            Instructions.OUTL: outl,
+            Instructions.OUTR: outr,
+            Instructions.OUTA: outa,
+            Instructions.OUTB: outb,
+            Instructions.MOVLA: load(a, True),
+            Instructions.MOVLB: load(b, True),
+            Instructions.MOVRA: load(a, False),
+            Instructions.MOVRB: load(b, False),
+            Instructions.MOVAR: save(a),
+            Instructions.MOVBR: save(b),
+            Instructions.ADDA: alu(a, lambda x, y: x + y),
+            Instructions.ADDB: alu(b, lambda x, y: x + y),
+            Instructions.SUBBA: alu(a, lambda x, y: x - y),
+            Instructions.SUBAB: alu(b, lambda x, y: y - x),
+            Instructions.ANDA: alu(a, lambda x, y: x & y),
+            Instructions.ANDB: alu(b, lambda x, y: x & y),
+            # ORA stores into B, exactly as CPU.execute does.
+            Instructions.ORA: alu(b, lambda x, y: x | y),
+            Instructions.ORB: alu(b, lambda x, y: x | y),
+            Instructions.JMPL: jmp('L'),
+            Instructions.JMPR: jmp('R'),
+            Instructions.JMPA: jmp('A'),
+            Instructions.JMPB: jmp('B'),
+            Instructions.JZFL: branch(self.zero, 'L'),
+            Instructions.JZFR: branch(self.zero, 'R'),
+            Instructions.JZFA: branch(self.zero, 'A'),
+            Instructions.JZFB: branch(self.zero, 'B'),
+            Instructions.JCFL: branch(self.carry, 'L'),
+            Instructions.JCFR: branch(self.carry, 'R'),
+            Instructions.JCFA: branch(self.carry, 'A'),
+            Instructions.JCFB: branch(self.carry, 'B'),
+        }
+        table = [undefined] * 256
+        for instruction, handler in handlers.items():
+            table[int(instruction.value, 16)] = handler
+        return table
+
+    def step(self):
+        lanes = np.flatnonzero(self.enable)
+        if lanes.size == 0:
+            return False
+        pc = self.pc[lanes]
+        ops = self.mem[lanes, pc]
+        pc = (pc + 1) & self.amask
+        args = self.mem[lanes, pc]
+        for op in np.unique(ops):
+            selected = ops == op
+            self.table[op](lanes[selected], pc[selected], args[selected])
+        self.cycle += 1
+        return True
+
+    def run(self, max_cycles=None):
+        count = 0
+        while max_cycles is None or count < max_cycles:
+            if not self.step():
+                break
+            count += 1
+        return count
+
+    def lane_state(self, lane: int):
+        return {
+            'PC': int(self.pc[lane]),
+            'A': int(self.a[lane]),
+            'B': int(self.b[lane]),
+            'OUT': int(self.out[lane]),
+            'CZ': int(self.cz[lane]),
+            'halted': not self.enable[lane] and not self.fault[lane],
+            'halt_cycle': int(self.halt_cycle[lane]),
+            'fault': bool(self.fault[lane]),
+        }
+
+    def to_cpu(self, lane: int):
+        cpu = CPU()
+        cpu.ram_mem.load(self.mem[lane].tobytes())
+        cpu.pc.value = int(self.pc[lane])
+        cpu.reg_a.value = int(self.a[lane])
+        cpu.reg_b.value = int(self.b[lane])
+        cpu.reg_out.value = int(self.out[lane])
+        cpu.reg_cz.value = int(self.cz[lane])
+        cpu.zero = bool(self.zero[lane])
+        cpu.carry = bool(self.carry[lane])
+        cpu.enable = bool(self.enable[lane])
+        return cpu
+
+
+def sweep(image, address: int, max_cycles=None, values=range(256)):
+    """Runs image once for every value placed at address."""
+    values = np.asarray(values, dtype=np.uint8)
+    machine = Lockstep(image, len(values))
+    machine.mem[:, address] = values
+    machine.run(max_cycles)
+    return machine
+
+
+if __name__ == '__main__':
+    # OUTR FF; HALT with every possible byte at FF
+    machine = sweep([2, 255, 0], 255)
+    print(machine.out[:16], machine.halt_cycle[:16])
@@ -0,0 +1,141 @@
+import random
+
+from package.engine import Dispatcher
+from package.mpu import CPU
+
+# Hashes are sums of values times random coefficients modulo this prime, so
+# two different states collide with a probability of about 1 / PRIME.
+PRIME = (1 << 61) - 1
+
+
+class LoopDetector:
+    """Finds the loop of a program that keeps revisiting the same state.
+
+    Attach one to CPU.detector. The state of the machine, its registers,
+    flags and RAM, is hashed before every instruction. The RAM part of the
+    hash is kept up to date by a RAM listener adjusting it by the cells
+    written, so hashing costs the same on every machine. Cycles are found
+    with Brent's algorithm, which compares the hash against one remembered
+    state moved forward at every power of two, and a matching hash is
+    confirmed against a full copy of that state. On a confirmed loop the
+    CPU is disabled after the current instruction and loop holds the
+    instruction count of the first state in the loop, its period and PC;
+    counts are from the first instruction the detector saw.
+    """
+
+    def __init__(self, cpu: CPU, seed: int = None):
+        rnd = random.Random(seed)
+        ram = cpu.ram_mem
+        self.ram = ram
+        self.memory = ram.memory
+        self.shadow = ram.memory[:]
+        self.coefficients = [rnd.randrange(1, PRIME)
+                             for _ in range(len(ram.memory))]
+        self.registers = [rnd.randrange(1, PRIME) for _ in range(6)]
+        self.ram_hash = sum(c * v for c, v in
+                            zip(self.coefficients, self.shadow)) % PRIME
+        ram.listeners.append(self.changed)
+        self.count = 0
+        self.start = None
+        self.saved = None
+        self.saved_state = None
+        self.saved_at = 0
+        self.power = 1
+        self.loop = None
+
+    def close(self):
+        """Stops following the RAM."""
+        if self.changed in self.ram.listeners:
+            self.ram.listeners.remove(self.changed)
+
+    def changed(self, start: int, stop: int):
+        mem = self.memory
+        shadow = self.shadow
+        coefficients = self.coefficients
+        value = self.ram_hash
+        for address in range(start, stop):
+            new = mem[address]
+            old = shadow[address]
+            if new != old:
+                value += coefficients[address] * (new - old)
+                shadow[address] = new
+        self.ram_hash = value % PRIME
+
+    def digest(self, cpu: CPU, pc: int):
+        c = self.registers
+        return (self.ram_hash + pc * c[0] + cpu.reg_a.value * c[1] +
+                cpu.reg_b.value * c[2] + cpu.reg_out.value * c[3] +
+                cpu.reg_cz.value * c[4] +
+                (cpu.carry | (cpu.zero << 1)) * c[5]) % PRIME
+
+    def record(self, cpu: CPU, pc: int, op: int):
+        if self.loop is not None:
+            return
+        value = self.digest(cpu, pc)
+        count = self.count
+        self.count = count + 1
+        if self.saved is None:
+            self.start = (cpu.snapshot(), pc)
+            self.remember(cpu, pc, value, count)
+        elif value == self.saved and state(cpu, pc) == self.saved_state:
+            period = count - self.saved_at
+            entry, entry_pc = self.locate(period)
+            self.loop = (entry, period, entry_pc)
+            cpu.enable = False
+        elif count - self.saved_at == self.power:
+            self.power <<= 1
+            self.remember(cpu, pc, value, count)
+
+    def remember(self, cpu: CPU, pc: int, value: int, count: int):
+        self.saved = value
+        self.saved_state = state(cpu, pc)
+        self.saved_at = count
+
+    def locate(self, period: int):
+        """Replays from the first state seen, one copy of the machine
+        period instructions ahead of the other, until both are in the
+        same state, returning its instruction count and PC."""
+        trail = self.replica()
+        lead = self.replica()
+        Dispatcher(lead).run(period)
+        trail_step = Dispatcher(trail).step
+        lead_step = Dispatcher(lead).step
+        entry = 0
+        while registers(trail, trail.pc.value) != \
+                registers(lead, lead.pc.value) or \
+                trail.ram_mem.memory != lead.ram_mem.memory:
+            trail_step()
+            lead_step()
+            entry += 1
+        return entry, trail.pc.value
+
+    def replica(self):
+        blob, pc = self.start
+        cpu = CPU(self.ram.addressWidth, self.ram.dataWidth)
+        cpu.restore(blob)
+        cpu.pc.value = pc
+        return cpu
+
+    def remaining(self, target: int):
+        """Instructions left to run, after a loop was found, for the CPU
+        to be in the state it would be in after target instructions."""
+        period = self.loop[1]
+        if target <= self.count:
+            return 0
+        return (target - self.count) % period
+
+    def report(self):
+        if self.loop is None:
+            return "NO LOOP AFTER {0}".format(self.count)
+        entry, period, pc = self.loop
+        return "LOOP AT {0} PC {1:02X} PERIOD {2}".format(entry, pc, period)
+
+
+# Engines keep the PC in a local while they run, so hooks are given it.
+def registers(cpu: CPU, pc: int):
+    return (pc, cpu.reg_a.value, cpu.reg_b.value,
+            cpu.reg_out.value, cpu.reg_cz.value, cpu.carry, cpu.zero)
+
+
+def state(cpu: CPU, pc: int):
+    return registers(cpu, pc), cpu.ram_mem.dump()
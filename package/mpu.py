@@ -1,5 +1,10 @@
+import struct
+import sys
+from array import array
 from enum import Enum, unique
 
+from package.image import load_image, save_image
+
 
 @unique
 class Instructions(Enum):
@@ -86,57 +91,211 @@ class Counter:
     def get_counter(self):
         return self.value
 
-    def inc_counter(self):
-        self.value += 1
+    def inc_counter(self, step: int = 1):
+        self.value += step
         if self.value > self.maxValue:
-            self.value = 0
+            self.value -= self.maxValue + 1
 
     def __str__(self):
         return format(self.value, '02X')
 
 
+class FlagRegister(Register):
+    """The CZ register, carry << 1 | zero, read from and written to the
+    flags of a CPU so it never goes out of step with them."""
+
+    def __init__(self, cpu: 'CPU'):
+        self.cpu = cpu
+        super().__init__(BitWidth.TWO_BIT)
+
+    @property
+    def value(self):
+        return (self.cpu.carry << 1) | self.cpu.zero
+
+    @value.setter
+    def value(self, value: int):
+        self.cpu.carry = bool(value & 2)
+        self.cpu.zero = bool(value & 1)
+
+
+# Array typecodes of the cells wider than a byte.
+TYPECODES = {16: 'H'}
+
+
 class RAM:
+    """Memory of addressMaxValue + 1 cells held in one flat buffer.
+
+    Cells of up to 8 bits live in a bytearray and 16 bit cells in an
+    array('H'). Everything that handles raw bytes, like images and
+    snapshots, goes through load_bytes and dump, which store wide cells
+    in little-endian order.
+    """
+
     def __init__(self, address_width: BitWidth, data_width: BitWidth):
         self.addressWidth = address_width
         self.dataWidth = data_width
         self.addressMaxValue = self.addressWidth.max_value()
         self.dataMaxValue = self.dataWidth.max_value()
-        self.memory = dict()
+        size = self.addressMaxValue + 1
+        if self.dataWidth.value <= 8:
+            self.memory = bytearray(size)
+        elif self.dataWidth.value in TYPECODES:
+            self.memory = array(TYPECODES[self.dataWidth.value], [0]) * size
+        else:
+            raise ValueError("Unsupported Data Width: " +
+                             str(self.dataWidth.value))
+        self.itemsize = memoryview(self.memory).itemsize
+        self.listeners = []
+
+    def notify(self, start: int, stop: int):
+        for listener in self.listeners:
+            listener(start, stop)
 
     def read(self, address: int):
-        if not (0 <= address <= self.addressMaxValue):
-            raise RuntimeError("Invalid Address: " + hex(address))
-        return self.memory.get(address, 0)
+        if 0 <= address <= self.addressMaxValue:
+            return self.memory[address]
+        raise RuntimeError("Invalid Address: " + hex(address))
 
     def write(self, address: int, value: int):
         if value > self.dataMaxValue:
             value = value - self.dataMaxValue
-        self.memory[address] = value
+        self.memory[address] = value & self.dataMaxValue
+        if self.listeners:
+            self.notify(address, address + 1)
+
+    def view(self, start: int = 0, stop: int = None):
+        """Zero-copy view of the memory between start and stop."""
+        if stop is None:
+            stop = self.addressMaxValue + 1
+        return memoryview(self.memory)[start:stop]
+
+    def page(self, number: int, size: int = 256):
+        """Zero-copy view of the number-th block of size cells."""
+        start = number * size
+        return self.view(start, start + size)
+
+    def load(self, data, offset: int = 0):
+        """Copies a sequence of cell values into memory at offset."""
+        if self.itemsize > 1 and not isinstance(data, array):
+            data = array(self.memory.typecode, data)
+        if offset + len(data) > self.addressMaxValue + 1:
+            raise RuntimeError("Invalid Address: " +
+                               hex(offset + len(data) - 1))
+        self.memory[offset:offset + len(data)] = data
+        if self.listeners:
+            self.notify(offset, offset + len(data))
+
+    def load_bytes(self, data, offset: int = 0):
+        """Copies raw little-endian bytes into memory at offset."""
+        if self.itemsize == 1:
+            self.load(data, offset)
+            return
+        if len(data) % self.itemsize:
+            raise RuntimeError("Invalid Length: " + str(len(data)))
+        cells = array(self.memory.typecode)
+        cells.frombytes(data)
+        if sys.byteorder == 'big':
+            cells.byteswap()
+        self.load(cells, offset)
+
+    def dump(self, start: int = 0, stop: int = None):
+        """Raw little-endian bytes of the memory between start and stop."""
+        view = self.view(start, stop)
+        if self.itemsize > 1 and sys.byteorder == 'big':
+            cells = array(self.memory.typecode, view)
+            cells.byteswap()
+            return cells.tobytes()
+        return bytes(view)
+
+    def clear(self):
+        view = memoryview(self.memory).cast('B')
+        view[:] = bytes(len(view))
+        if self.listeners:
+            self.notify(0, len(self.memory))
 
     def get_mem_list(self):
-        mem_list = []
-        for row in range(16):
-            for col in range(16):
-                mem_list.append(self.read(row * 16 + col))
-        return mem_list
+        return list(self.memory)
+
+
+# Supported machines: (address width, data width). An operand holds one
+# address, so on 'wide8' it takes two cells, low cell first.
+PROFILES = {
+    'mpu8': (BitWidth.EIGHT_BIT, BitWidth.EIGHT_BIT),
+    'wide8': (BitWidth.SIXTEEN_BIT, BitWidth.EIGHT_BIT),
+    'wide16': (BitWidth.SIXTEEN_BIT, BitWidth.SIXTEEN_BIT),
+}
+
+# magic, address bits, data bits, PC, A, B, OUT, CZ, flags, phase and the
+# fetched instruction, followed by the whole RAM.
+SNAPSHOT = struct.Struct('<4sBBqqqqBBBH')
+SNAPSHOT_MAGIC = b'MPU1'
 
 
 class CPU:
-    def __init__(self):
-        self.pc = Counter(BitWidth.EIGHT_BIT)
-        self.reg_a = Register(BitWidth.EIGHT_BIT)
-        self.reg_b = Register(BitWidth.EIGHT_BIT)
-        self.reg_out = Register(BitWidth.EIGHT_BIT)
-        self.ram_mem = RAM(BitWidth.EIGHT_BIT, BitWidth.EIGHT_BIT)
-        self.reg_cz = Register(BitWidth.TWO_BIT)
+    def __init__(self, address_width: BitWidth = BitWidth.EIGHT_BIT,
+                 data_width: BitWidth = BitWidth.EIGHT_BIT):
+        if (address_width, data_width) not in PROFILES.values():
+            raise ValueError("Unsupported Machine: " +
+                             str(address_width.value) + "/" +
+                             str(data_width.value))
+        self.pc = Counter(address_width)
+        self.reg_a = Register(data_width)
+        self.reg_b = Register(data_width)
+        self.reg_out = Register(data_width)
+        self.ram_mem = RAM(address_width, data_width)
+        self.operand_cells = address_width.value // data_width.value
 
         self.enable = False
 
-        self.carry = False
-        self.zero = False
+        # The flags follow from the last ALU result, kept as it is and
+        # only compared when they are read; None once they were set.
+        self.alu_result = None
+        self._carry = False
+        self._zero = False
+        self.reg_cz = FlagRegister(self)
 
         self.current_instruction = 0
         self.current_instruction_decoded = 0
+        self.phase = 0
+
+        self.out_history = None
+        self.profiler = None
+        self.tracer = None
+        self.debugger = None
+        self.detector = None
+
+    @classmethod
+    def from_profile(cls, name: str):
+        if name not in PROFILES:
+            raise ValueError("Unknown Machine: " + name)
+        return cls(*PROFILES[name])
+
+    def observer(self):
+        """The function engines call before every instruction, or None.
+
+        It calls record(cpu, pc, opcode) on the profiler, the tracer and
+        the loop detector, whichever are attached.
+        """
+        hooks = [hook.record for hook in
+                 (self.profiler, self.tracer, self.detector)
+                 if hook is not None]
+        if not hooks:
+            return None
+        if len(hooks) == 1:
+            return hooks[0]
+
+        def record(cpu, pc: int, op: int):
+            for hook in hooks:
+                hook(cpu, pc, op)
+        return record
+
+    def stops_at(self, pc: int, op: int):
+        """Whether the debugger stops the instruction at pc, for callers
+        running one instruction at a time."""
+        if self.debugger is None:
+            return False
+        return self.debugger.take_resume() != pc and \
+            self.debugger.check(self, pc, op)
 
     def is_enabled(self):
         return self.enable
@@ -145,34 +304,61 @@ class CPU:
         self.enable = status
 
     def set_instructions(self, commands: list):
-        for i in range(self.ram_mem.addressMaxValue + 1):
-            self.ram_mem.write(i,
-                               commands[i]
-                               if i < len(commands)
-                               else 0)
+        size = self.ram_mem.addressMaxValue + 1
+        data_max = self.ram_mem.dataMaxValue
+        self.ram_mem.clear()
+        self.ram_mem.load([(c - data_max if c > data_max else c) & data_max
+                           for c in commands[:size]])
 
     def reset(self):
         self.pc.set_counter(0)
         self.reg_a.set_value(0)
         self.reg_b.set_value(0)
         self.reg_out.set_value(0)
-
-    def cz(self, num: int):
-        c = ''
-        z = ''
-        if num == 0:
-            z = '1'
-            self.zero = True
-        else:
-            z = '0'
-            self.zero = False
-        if num > 255:
-            c = '1'
-            self.carry = True
-        else:
-            c = '0'
-            self.carry = False
-        return int(c+z, 2)
+        self.phase = 0
+
+    def output(self, value: int):
+        self.reg_out.set_value(value)
+        if self.out_history is not None:
+            self.out_history.append(self.reg_out.get_value())
+
+    @property
+    def carry(self):
+        if self.alu_result is None:
+            return self._carry
+        return self.alu_result > self.reg_a.maxValue
+
+    @carry.setter
+    def carry(self, value: bool):
+        self.settle_flags()
+        self._carry = bool(value)
+
+    @property
+    def zero(self):
+        if self.alu_result is None:
+            return self._zero
+        return self.alu_result == 0
+
+    @zero.setter
+    def zero(self, value: bool):
+        self.settle_flags()
+        self._zero = bool(value)
+
+    def settle_flags(self):
+        """Turns the flags of the last ALU result into stored ones."""
+        if self.alu_result is not None:
+            self._carry = self.alu_result > self.reg_a.maxValue
+            self._zero = self.alu_result == 0
+            self.alu_result = None
+
+    def read_word(self, address: int):
+        """Reads the address-wide operand starting at address."""
+        value = self.ram_mem.read(address)
+        for i in range(1, self.operand_cells):
+            address = (address + 1) & self.pc.maxValue
+            value |= self.ram_mem.read(address) << \
+                (i * self.ram_mem.dataWidth.value)
+        return value
 
     def fetch(self):
         self.current_instruction = self.ram_mem.read(
@@ -190,113 +376,113 @@ class CPU:
             self.set_enabled(False)
 
         elif i == Instructions.OUTL:
-            arg = self.ram_mem.read(self.pc.get_counter())
-            self.reg_out.set_value(arg)
-            self.pc.inc_counter()
+            arg = self.read_word(self.pc.get_counter())
+            self.output(arg)
+            self.pc.inc_counter(self.operand_cells)
 
         elif i == Instructions.OUTR:
-            arg = self.ram_mem.read(self.pc.get_counter())
+            arg = self.read_word(self.pc.get_counter())
             arg_mem = self.ram_mem.read(arg)
-            self.reg_out.set_value(arg_mem)
-            self.pc.inc_counter()
+            self.output(arg_mem)
+            self.pc.inc_counter(self.operand_cells)
 
         elif i == Instructions.OUTA:
             arg_a = self.reg_a.get_value()
-            self.reg_out.set_value(arg_a)
+            self.output(arg_a)
 
         elif i == Instructions.OUTB:
             arg_b = self.reg_b.get_value()
-            self.reg_out.set_value(arg_b)
+            self.output(arg_b)
 
         elif i == Instructions.MOVLA:
-            arg = self.ram_mem.read(self.pc.get_counter())
+            arg = self.read_word(self.pc.get_counter())
             self.reg_a.set_value(arg)
-            self.pc.inc_counter()
+            self.pc.inc_counter(self.operand_cells)
 
         elif i == Instructions.MOVLB:
-            arg = self.ram_mem.read(self.pc.get_counter())
+            arg = self.read_word(self.pc.get_counter())
             self.reg_b.set_value(arg)
-            self.pc.inc_counter()
+            self.pc.inc_counter(self.operand_cells)
 
         elif i == Instructions.MOVRA:
-            arg = self.ram_mem.read(self.pc.get_counter())
+            arg = self.read_word(self.pc.get_counter())
             arg_mem = self.ram_mem.read(arg)
             self.reg_a.set_value(arg_mem)
-            self.pc.inc_counter()
+            self.pc.inc_counter(self.operand_cells)
 
         elif i == Instructions.MOVRB:
-            arg = self.ram_mem.read(self.pc.get_counter())
+            arg = self.read_word(self.pc.get_counter())
             arg_mem = self.ram_mem.read(arg)
             self.reg_b.set_value(arg_mem)
-            self.pc.inc_counter()
+            self.pc.inc_counter(self.operand_cells)
 
         elif i == Instructions.MOVAR:
-            arg = self.ram_mem.read(self.pc.get_counter())
+            arg = self.read_word(self.pc.get_counter())
             arg_a = self.reg_a.get_value()
             self.ram_mem.write(arg, arg_a)
-            self.pc.inc_counter()
+            self.pc.inc_counter(self.operand_cells)
 
         elif i == Instructions.MOVBR:
-            arg = self.ram_mem.read(self.pc.get_counter())
+            arg = self.read_word(self.pc.get_counter())
             arg_b = self.reg_b.get_value()
             self.ram_mem.write(arg, arg_b)
-            self.pc.inc_counter()
+            self.pc.inc_counter(self.operand_cells)
 
         elif i == Instructions.ADDA:
             arg_a = self.reg_a.get_value()
             arg_b = self.reg_b.get_value()
             self.reg_a.set_value(arg_a+arg_b)
-            self.reg_cz.set_value(self.cz(arg_a+arg_b))
+            self.alu_result = arg_a+arg_b
 
         elif i == Instructions.ADDB:
             arg_a = self.reg_a.get_value()
             arg_b = self.reg_b.get_value()
             self.reg_b.set_value(arg_a+arg_b)
-            self.reg_cz.set_value(self.cz(arg_a+arg_b))
+            self.alu_result = arg_a+arg_b
 
         elif i == Instructions.SUBBA:
             arg_a = self.reg_a.get_value()
             arg_b = self.reg_b.get_value()
             self.reg_a.set_value(arg_a-arg_b)
-            self.reg_cz.set_value(self.cz(arg_a-arg_b))
+            self.alu_result = arg_a-arg_b
 
         elif i == Instructions.SUBAB:
             arg_a = self.reg_a.get_value()
             arg_b = self.reg_b.get_value()
             self.reg_b.set_value(arg_b-arg_a)
-            self.reg_cz.set_value(self.cz(arg_b-arg_a))
+            self.alu_result = arg_b-arg_a
 
         elif i == Instructions.ANDA:
             arg_a = self.reg_a.get_value()
             arg_b = self.reg_b.get_value()
             self.reg_a.set_value(arg_a & arg_b)
-            self.reg_cz.set_value(self.cz(arg_b & arg_a))
+            self.alu_result = arg_b & arg_a
 
         elif i == Instructions.ANDB:
             arg_a = self.reg_a.get_value()
             arg_b = self.reg_b.get_value()
             self.reg_b.set_value(arg_a & arg_b)
-            self.reg_cz.set_value(self.cz(arg_b & arg_a))
+            self.alu_result = arg_b & arg_a
 
         elif i == Instructions.ORA:
             arg_a = self.reg_a.get_value()
             arg_b = self.reg_b.get_value()
             self.reg_b.set_value(arg_a | arg_b)
-            self.reg_cz.set_value(self.cz(arg_b | arg_a))
+            self.alu_result = arg_b | arg_a
 
         elif i == Instructions.ORB:
             arg_a = self.reg_a.get_value()
             arg_b = self.reg_b.get_value()
             self.reg_b.set_value(arg_a | arg_b)
-            self.reg_cz.set_value(self.cz(arg_b | arg_a))
+            self.alu_result = arg_b | arg_a
 
         elif i == Instructions.JMPL:
-            arg = self.ram_mem.read(self.pc.get_counter())
+            arg = self.read_word(self.pc.get_counter())
             self.pc.set_counter(arg)
 
         elif i == Instructions.JMPR:
-            arg = self.ram_mem.read(self.pc.get_counter())
-            arg_mem = self.ram_mem.read(arg)
+            arg = self.read_word(self.pc.get_counter())
+            arg_mem = self.read_word(arg)
             self.pc.set_counter(arg_mem)
 
         elif i == Instructions.JMPA:
@@ -308,19 +494,19 @@ class CPU:
             self.pc.set_counter(arg_b)
 
         elif i == Instructions.JZFL:
-            arg = self.ram_mem.read(self.pc.get_counter())
+            arg = self.read_word(self.pc.get_counter())
             if self.zero:
                 self.pc.set_counter(arg)
             else:
-                self.pc.inc_counter()
+                self.pc.inc_counter(self.operand_cells)
 
         elif i == Instructions.JZFR:
-            arg = self.ram_mem.read(self.pc.get_counter())
-            arg_mem = self.ram_mem.read(arg)
+            arg = self.read_word(self.pc.get_counter())
+            arg_mem = self.read_word(arg)
             if self.zero:
                 self.pc.set_counter(arg_mem)
             else:
-                self.pc.inc_counter()
+                self.pc.inc_counter(self.operand_cells)
 
         elif i == Instructions.JZFA:
             arg_a = self.reg_a.get_value()
@@ -333,19 +519,19 @@ class CPU:
                 self.pc.set_counter(arg_b)
 
         elif i == Instructions.JCFL:
-            arg = self.ram_mem.read(self.pc.get_counter())
+            arg = self.read_word(self.pc.get_counter())
             if self.carry:
                 self.pc.set_counter(arg)
             else:
-                self.pc.inc_counter()
+                self.pc.inc_counter(self.operand_cells)
 
         elif i == Instructions.JCFR:
-            arg = self.ram_mem.read(self.pc.get_counter())
-            arg_mem = self.ram_mem.read(arg)
+            arg = self.read_word(self.pc.get_counter())
+            arg_mem = self.read_word(arg)
             if self.carry:
                 self.pc.set_counter(arg_mem)
             else:
-                self.pc.inc_counter()
+                self.pc.inc_counter(self.operand_cells)
 
         elif i == Instructions.JCFA:
             arg_a = self.reg_a.get_value()
@@ -357,6 +543,89 @@ class CPU:
             if self.carry:
                 self.pc.set_counter(arg_b)
 
+    def step(self):
+        """Runs one instruction, returning False if the debugger
+        stopped it."""
+        op = self.ram_mem.memory[self.pc.value]
+        if self.stops_at(self.pc.value, op):
+            return False
+        record = self.observer()
+        if record is not None:
+            record(self, self.pc.value, op)
+        self.fetch()
+        self.decode()
+        self.execute()
+        return True
+
+    def tick(self):
+        if self.phase == 0:
+            op = self.ram_mem.memory[self.pc.value]
+            if self.stops_at(self.pc.value, op):
+                return
+            record = self.observer()
+            if record is not None:
+                record(self, self.pc.value, op)
+            self.fetch()
+        elif self.phase == 1:
+            self.decode()
+        else:
+            self.execute()
+        self.phase = (self.phase + 1) % 3
+
+    def snapshot(self):
+        flags = self.carry | (self.zero << 1) | (self.enable << 2)
+        header = SNAPSHOT.pack(SNAPSHOT_MAGIC,
+                               self.pc.bitWidth.value,
+                               self.ram_mem.dataWidth.value,
+                               self.pc.value,
+                               self.reg_a.value,
+                               self.reg_b.value,
+                               self.reg_out.value,
+                               self.reg_cz.value,
+                               flags,
+                               self.phase,
+                               self.current_instruction)
+        return header + self.ram_mem.dump()
+
+    def restore(self, blob: bytes):
+        (magic, address_bits, data_bits, pc, reg_a, reg_b, reg_out, reg_cz,
+         flags, phase, instruction) = SNAPSHOT.unpack_from(blob)
+        if magic != SNAPSHOT_MAGIC:
+            raise RuntimeError("Invalid Snapshot")
+        if address_bits != self.pc.bitWidth.value or \
+                data_bits != self.ram_mem.dataWidth.value or \
+                len(blob) != SNAPSHOT.size + \
+                len(self.ram_mem.memory) * self.ram_mem.itemsize:
+            raise RuntimeError("Snapshot Does Not Match Machine")
+        self.pc.value = pc
+        self.reg_a.value = reg_a
+        self.reg_b.value = reg_b
+        self.reg_out.value = reg_out
+        self.reg_cz.value = reg_cz
+        self.carry = bool(flags & 1)
+        self.zero = bool(flags & 2)
+        self.enable = bool(flags & 4)
+        self.phase = phase
+        self.current_instruction = instruction
+        self.current_instruction_decoded = Instructions.find_instruction(
+            format(instruction, '02X'))
+        self.ram_mem.load_bytes(memoryview(blob)[SNAPSHOT.size:])
+
+    def save_snapshot(self, path: str):
+        with open(path, 'wb') as f:
+            f.write(self.snapshot())
+
+    def load_snapshot(self, path: str):
+        with open(path, 'rb') as f:
+            self.restore(f.read())
+
+    def load_image(self, path: str):
+        """Loads a raw binary or Intel HEX image into RAM."""
+        load_image(self.ram_mem, path)
+
+    def save_image(self, path: str, sparse: bool = False):
+        save_image(self.ram_mem, path, sparse)
+
     def __str__(self):
         output_str = ""
 
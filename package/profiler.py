@@ -0,0 +1,63 @@
+from package.mpu import Instructions
+
+NAMES = {int(i.value, 16): i.name for i in Instructions}
+
+CONDITIONAL = frozenset(int(i.value, 16) for i in Instructions
+                        if i.name[:3] in ('JZF', 'JCF'))
+
+
+class Profiler:
+    """Counts executed instructions per opcode and per address.
+
+    Attach one to CPU.profiler to start counting; every engine checks for
+    it once per run and only then switches to an instrumented loop. For
+    the conditional jumps the taken and not-taken outcomes are counted
+    per address as well.
+    """
+
+    def __init__(self, size: int = 256, opcodes: int = 256):
+        self.size = size
+        self.opcode_count = opcodes
+        self.clear()
+
+    def clear(self):
+        self.cycles = 0
+        self.opcodes = [0] * self.opcode_count
+        self.addresses = [0] * self.size
+        self.taken = [0] * self.size
+        self.not_taken = [0] * self.size
+
+    def record(self, cpu, pc: int, op: int):
+        self.cycles += 1
+        self.opcodes[op] += 1
+        self.addresses[pc] += 1
+        if op in CONDITIONAL:
+            if cpu.zero if op >> 4 == 5 else cpu.carry:
+                self.taken[pc] += 1
+            else:
+                self.not_taken[pc] += 1
+
+    def hottest(self, n: int = 10):
+        ranked = sorted(range(self.size), key=lambda a: -self.addresses[a])
+        return [(a, self.addresses[a]) for a in ranked[:n]
+                if self.addresses[a]]
+
+    def opcode_counts(self):
+        return {NAMES.get(op, format(op, '02X')): count
+                for op, count in enumerate(self.opcodes) if count}
+
+    def branches(self):
+        return {a: (self.taken[a], self.not_taken[a])
+                for a in range(self.size)
+                if self.taken[a] or self.not_taken[a]}
+
+    def report(self, mem, n: int = 10):
+        lines = ["CYCLES " + str(self.cycles)]
+        for address, count in self.hottest(n):
+            line = "{0:02X}  {1:>10}  {2:<5}".format(
+                address, count, NAMES.get(mem[address], '??'))
+            if self.taken[address] or self.not_taken[address]:
+                line += "  taken {0} / not taken {1}".format(
+                    self.taken[address], self.not_taken[address])
+            lines.append(line.rstrip())
+        return lines
@@ -0,0 +1,85 @@
+import curses
+from array import array
+
+
+class Renderer:
+    """Repaints only what changed since the previous frame.
+
+    It remembers the title and text last drawn in every window and the
+    cells and highlighted cell last drawn in the RAM window. The RAM
+    window shows one page of rows by columns cells, so a frame costs the
+    same however large the memory is. Windows are only marked with
+    noutrefresh, so a frame costs a single doupdate.
+    """
+
+    def __init__(self, columns: int = 16, digits: int = 2, rows: int = 16):
+        self.columns = columns
+        self.digits = digits
+        self.rows = rows
+        self.cell_format = '0' + str(digits) + 'X'
+        self.titles = dict()
+        self.texts = dict()
+        self.cells = None
+        self.marked = None
+
+    @property
+    def page_size(self):
+        return self.rows * self.columns
+
+    def invalidate(self):
+        self.titles.clear()
+        self.texts.clear()
+        self.cells = None
+        self.marked = None
+
+    def title(self, window: 'curses._CursesWindow', title: str):
+        if self.titles.get(window) == title:
+            return
+        self.titles[window] = title
+        height, width = window.getmaxyx()
+        window.box(0, 0)
+        window.addstr(0, (width//2)-len(title)//2, title, curses.A_BOLD)
+        window.noutrefresh()
+
+    def text(self, window: 'curses._CursesWindow', content: str):
+        old = self.texts.get(window)
+        if old == content:
+            return
+        self.texts[window] = content
+        reg_h, reg_w = window.getmaxyx()
+        blank = max(3, len(old or ''))
+        window.addstr(reg_h//2, (reg_w//2)-blank//2, " " * blank)
+        window.addstr(reg_h//2, (reg_w//2)-len(content)//2, content)
+        window.noutrefresh()
+
+    def cell(self, window: 'curses._CursesWindow', index: int, value: int,
+             attr: int = curses.A_NORMAL):
+        row, col = divmod(index, self.columns)
+        window.addstr(row+1, col*(self.digits+1)+1,
+                      format(value, self.cell_format), attr)
+
+    def ram(self, window: 'curses._CursesWindow', mem, index: int,
+            attr: int = curses.A_NORMAL):
+        """Draws mem, a memoryview of the visible page, marking index."""
+        marked = (index, attr)
+        cells = self.cells
+        if cells is None:
+            cells = self.cells = array(mem.format, mem)
+            for i, value in enumerate(cells):
+                self.cell(window, i, value)
+            self.marked = None
+        elif mem == cells and self.marked == marked:
+            return
+        elif mem != cells:
+            for i in range(len(cells)):
+                if mem[i] != cells[i]:
+                    cells[i] = mem[i]
+                    self.cell(window, i, cells[i])
+        if self.marked is not None:
+            self.cell(window, self.marked[0], cells[self.marked[0]])
+        self.cell(window, index, cells[index], attr)
+        self.marked = marked
+        window.noutrefresh()
+
+    def update(self):
+        curses.doupdate()
@@ -0,0 +1,185 @@
+import argparse
+import json
+import sys
+
+from package.cache import CompileCache
+from package.compiler import CompilerError
+from package.debug import Debugger
+from package.engine import ENGINES, create_engine
+from package.loops import LoopDetector
+from package.mpu import CPU, PROFILES
+from package.trace import Tracer
+
+
+def parse_range(text: str):
+    start, _, stop = text.partition(':')
+    start = int(start, 16)
+    stop = int(stop, 16) + 1 if stop else start + 1
+    if not 0 <= start < stop:
+        raise argparse.ArgumentTypeError("Invalid Range: " + text)
+    return start, stop
+
+
+def execute(source: str, max_cycles: int = None, engine: str = 'dispatch',
+            cache: CompileCache = None, machine: str = 'mpu8',
+            trace: str = None, debugger: Debugger = None,
+            loops: str = None):
+    cpu = CPU.from_profile(machine)
+    if cache is None:
+        cache = CompileCache(1, address_bits=cpu.pc.bitWidth.value,
+                             data_bits=cpu.ram_mem.dataWidth.value)
+    image, error = cache.compile(source)
+    if error != CompilerError.NoError:
+        return cpu, error, 0
+    cpu.set_instructions(image)
+    cpu.out_history = []
+    cpu.reset()
+    cpu.set_enabled(True)
+    cpu.debugger = debugger
+    if trace is not None:
+        cpu.tracer = Tracer(trace)
+    if loops is not None:
+        cpu.detector = LoopDetector(cpu)
+    try:
+        runner = create_engine(cpu, engine)
+        cycles = runner.run(max_cycles)
+        detector = cpu.detector
+        if loops == 'skip' and detector is not None and \
+                detector.loop is not None and max_cycles is not None:
+            # The state after max_cycles instructions is the one reached
+            # by running whatever part of a period the budget has left.
+            cpu.detector = None
+            cpu.set_enabled(True)
+            runner.run(detector.remaining(max_cycles))
+            cpu.detector = detector
+            cycles = max_cycles
+    finally:
+        if cpu.tracer is not None:
+            cpu.tracer.close()
+    return cpu, error, cycles
+
+
+def report(cpu: CPU, error: CompilerError, cycles: int, ranges: list):
+    hit = cpu.debugger.hit if cpu.debugger is not None else None
+    loop = cpu.detector.loop if cpu.detector is not None else None
+    return {
+        'error': error.name,
+        'halted': error == CompilerError.NoError and
+        not cpu.is_enabled() and hit is None and loop is None,
+        'cycles': cycles,
+        'registers': {
+            'A': cpu.reg_a.get_value(),
+            'B': cpu.reg_b.get_value(),
+            'OUT': cpu.reg_out.get_value(),
+            'PC': cpu.pc.get_counter(),
+            'CZ': cpu.reg_cz.get_value(),
+        },
+        'out': cpu.out_history or [],
+        'break': hit,
+        'loop': None if loop is None else
+        {'entry': loop[0], 'period': loop[1], 'pc': loop[2]},
+        'ram': {format(start, '02X'): list(cpu.ram_mem.view(start, stop))
+                for start, stop in ranges},
+    }
+
+
+def format_text(result: dict):
+    lines = []
+    lines.append("ERROR:\t" + result['error'])
+    lines.append("HALT:\t" + ('yes' if result['halted'] else 'no'))
+    lines.append("CYCLES:\t" + str(result['cycles']))
+    if result['break'] is not None:
+        lines.append("BREAK:\t" + result['break'])
+    if result['loop'] is not None:
+        lines.append("LOOP:\t{entry} PC {pc:02X} PERIOD {period}".format(
+            **result['loop']))
+    for name, value in result['registers'].items():
+        fmt = '02b' if name == 'CZ' else '02X'
+        lines.append(name + ":\t" + format(value, fmt))
+    lines.append("HIST:\t" + " ".join(format(v, '02X')
+                                      for v in result['out']))
+    for start, values in result['ram'].items():
+        addr = int(start, 16)
+        for row in range(0, len(values), 16):
+            lines.append(format(addr + row, '02X') + ":\t" +
+                         " ".join(format(v, '02X')
+                                  for v in values[row:row + 16]))
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m package.run',
+        description="Assemble and run a program without the curses UI.")
+    parser.add_argument('source',
+                        help="assembly file, '-' reads standard input")
+    parser.add_argument('-c', '--cycles', type=int, default=1000000,
+                        help="instruction budget before giving up")
+    parser.add_argument('-r', '--ram', type=parse_range, action='append',
+                        default=[], metavar='START[:END]',
+                        help="hex RAM range to print, may be repeated")
+    parser.add_argument('-e', '--engine', choices=sorted(ENGINES),
+                        default='dispatch')
+    parser.add_argument('-m', '--machine', choices=sorted(PROFILES),
+                        default='mpu8')
+    parser.add_argument('-b', '--break', dest='breaks', action='append',
+                        default=[], metavar='SPEC',
+                        help="stop at a hex address or when a condition "
+                             "such as 'A > B' holds, may be repeated")
+    parser.add_argument('-w', '--watch', type=lambda s: int(s, 16),
+                        action='append', default=[], metavar='ADDR',
+                        help="stop before a hex RAM address is read or "
+                             "written, may be repeated")
+    parser.add_argument('-l', '--loops', choices=['stop', 'skip'],
+                        help="detect a program revisiting a state and stop, "
+                             "or skip ahead to the end of the budget")
+    parser.add_argument('-t', '--trace', metavar='FILE',
+                        help="record every instruction to this file")
+    parser.add_argument('--json', action='store_true',
+                        help="print the result as JSON")
+    parser.add_argument('-O', '--optimize', action='store_true',
+                        help="run the program through the peephole "
+                             "optimizer")
+    parser.add_argument('--cache', metavar='DIR',
+                        help="keep assembled images in this directory")
+    args = parser.parse_args(argv)
+
+    if args.source == '-':
+        source = sys.stdin.read()
+    else:
+        with open(args.source) as f:
+            source = f.read()
+
+    debugger = None
+    if args.breaks or args.watch:
+        debugger = Debugger()
+        try:
+            for spec in args.breaks:
+                debugger.add(spec)
+        except ValueError as err:
+            parser.error(str(err))
+        for address in args.watch:
+            debugger.watch(address)
+
+    address_width, data_width = PROFILES[args.machine]
+    for start, stop in args.ram:
+        if stop > address_width.max_value() + 1:
+            parser.error("Invalid Range: " + format(start, '02X') + ":" +
+                         format(stop - 1, '02X'))
+    cache = CompileCache(directory=args.cache,
+                         address_bits=address_width.value,
+                         data_bits=data_width.value,
+                         optimize=args.optimize)
+    cpu, error, cycles = execute(source, args.cycles, args.engine, cache,
+                                 args.machine, args.trace, debugger,
+                                 args.loops)
+    result = report(cpu, error, cycles, args.ram)
+    if args.json:
+        print(json.dumps(result))
+    else:
+        print(format_text(result))
+    return 0 if result['halted'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,148 @@
+import gzip
+import queue
+import struct
+import threading
+
+from package.mpu import Instructions
+
+# cycle, PC, opcode, operand, A, B, OUT, flags (carry | zero << 1) and the
+# RAM address and value written, address -1 when nothing is written. The
+# registers are those before the instruction runs; they are signed 64 bit
+# as SUBBA and SUBAB can drive them negative without bound.
+RECORD = struct.Struct('<QHHHqqqBii')
+pack_into = RECORD.pack_into
+TRACE_MAGIC = b'MPT2'
+
+ARG_OPCODES = frozenset(int(i.value, 16) for i in (
+    Instructions.OUTL, Instructions.OUTR, Instructions.MOVLA,
+    Instructions.MOVLB, Instructions.MOVRA, Instructions.MOVRB,
+    Instructions.MOVAR, Instructions.MOVBR, Instructions.JMPL,
+    Instructions.JMPR, Instructions.JZFL, Instructions.JZFR,
+    Instructions.JCFL, Instructions.JCFR))
+MOVAR = int(Instructions.MOVAR.value, 16)
+MOVBR = int(Instructions.MOVBR.value, 16)
+
+
+def trace_dtype():
+    import numpy as np
+    return np.dtype([('cycle', '<u8'), ('pc', '<u2'), ('opcode', '<u2'),
+                     ('operand', '<u2'), ('a', '<i8'), ('b', '<i8'),
+                     ('out', '<i8'), ('flags', 'u1'),
+                     ('write_address', '<i4'), ('write_value', '<i4')])
+
+
+def to_array(data):
+    """Structured NumPy array of the records held in data."""
+    import numpy as np
+    return np.frombuffer(data, dtype=trace_dtype())
+
+
+def load_trace(path: str):
+    """Reads a file written by Tracer back as a structured NumPy array."""
+    with gzip.open(path, 'rb') as f:
+        data = f.read()
+    if data[:len(TRACE_MAGIC)] != TRACE_MAGIC or \
+            (len(data) - len(TRACE_MAGIC)) % RECORD.size:
+        raise RuntimeError("Invalid Trace")
+    return to_array(memoryview(data)[len(TRACE_MAGIC):])
+
+
+class Tracer:
+    """Records one fixed size record per executed instruction.
+
+    Attach one to CPU.tracer to start recording. Records are packed into
+    preallocated chunks of chunk_records; with a path every full chunk is
+    handed to a writer thread which compresses it into a gzip file and
+    returns the chunk for reuse, so recording only packs bytes. Without a
+    path the chunks are kept in memory. NumPy is only needed to read the
+    records back.
+    """
+
+    def __init__(self, path: str = None, chunk_records: int = 1 << 16):
+        self.path = path
+        self.chunk_size = chunk_records * RECORD.size
+        self.chunk = bytearray(self.chunk_size)
+        self.offset = 0
+        self.cycles = 0
+        self.chunks = []
+        self.free = queue.Queue()
+        self.pending = None
+        self.writer = None
+        self.error = None
+        if path is not None:
+            self.file = gzip.open(path, 'wb', compresslevel=1)
+            self.file.write(TRACE_MAGIC)
+            self.pending = queue.Queue()
+            self.writer = threading.Thread(target=self.write, daemon=True)
+            self.writer.start()
+
+    def record(self, cpu, pc: int, op: int):
+        a = cpu.reg_a.value
+        b = cpu.reg_b.value
+        operand = 0
+        address = -1
+        value = 0
+        if op in ARG_OPCODES:
+            if cpu.operand_cells == 1:
+                operand = cpu.ram_mem.memory[(pc + 1) & cpu.pc.maxValue]
+            else:
+                operand = cpu.read_word((pc + 1) & cpu.pc.maxValue)
+            if op == MOVAR or op == MOVBR:
+                # The value as the store leaves it in the cell.
+                value = a if op == MOVAR else b
+                dmax = cpu.reg_a.maxValue
+                if value > dmax:
+                    value = value - dmax
+                address, value = operand, value & dmax
+        offset = self.offset
+        pack_into(self.chunk, offset, self.cycles, pc, op, operand, a, b,
+                  cpu.reg_out.value, cpu.carry | (cpu.zero << 1), address,
+                  value)
+        self.cycles += 1
+        offset += RECORD.size
+        self.offset = offset
+        if offset == self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """Hands the records recorded so far to the writer."""
+        if not self.offset:
+            return
+        if self.writer is None:
+            self.chunks.append(bytes(self.chunk[:self.offset]))
+        else:
+            self.pending.put((self.chunk, self.offset))
+            try:
+                self.chunk = self.free.get_nowait()
+            except queue.Empty:
+                self.chunk = bytearray(self.chunk_size)
+        self.offset = 0
+
+    def write(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                break
+            chunk, size = item
+            try:
+                if self.error is None:
+                    self.file.write(memoryview(chunk)[:size])
+            except OSError as err:
+                self.error = err
+            self.free.put(chunk)
+
+    def close(self):
+        """Writes out the remaining records and closes the file."""
+        self.flush()
+        if self.writer is not None:
+            self.pending.put(None)
+            self.writer.join()
+            self.writer = None
+            self.file.close()
+            if self.error is not None:
+                raise self.error
+
+    def array(self):
+        """The records kept in memory as a structured NumPy array."""
+        return to_array(b''.join(self.chunks) +
+                        bytes(self.chunk[:self.offset]))
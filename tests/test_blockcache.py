@@ -0,0 +1,81 @@
+import unittest
+
+from package.blockcache import HOT_INVALIDATIONS, BlockCache
+from package.compiler import Compiler
+from package.engine import Dispatcher
+from package.mpu import CPU
+
+# Increments the operand of its own OUTL on every pass.
+SELF_MODIFYING = """
+    MOVRA 08
+    MOVLB 01
+    ADDA
+    MOVAR 08
+    OUTL 00
+    JMPL 00
+"""
+
+
+def machine(source: str):
+    image, _ = Compiler(source.split()).compile()
+    cpu = CPU()
+    cpu.set_instructions(image)
+    cpu.out_history = []
+    cpu.set_enabled(True)
+    return cpu
+
+
+def state(cpu: CPU):
+    return (cpu.pc.value, cpu.reg_a.value, cpu.reg_b.value,
+            cpu.reg_out.value, cpu.carry, cpu.zero, cpu.enable,
+            cpu.ram_mem.dump(), cpu.out_history)
+
+
+class BlockCacheTest(unittest.TestCase):
+
+    def test_write_drops_translated_block(self):
+        cpu = machine("OUTL 01 HALT")
+        cache = BlockCache(cpu)
+        cache.run()
+        self.assertEqual(cpu.out_history, [1])
+        self.assertIsNotNone(cache.blocks[0])
+        cpu.ram_mem.write(1, 7)
+        self.assertIsNone(cache.blocks[0])
+        self.assertEqual(cache.stats()['invalidations'], 1)
+        cpu.reset()
+        cpu.set_enabled(True)
+        cache.run()
+        self.assertEqual(cpu.out_history, [1, 7])
+
+    def test_self_modifying_code(self):
+        reference = machine(SELF_MODIFYING)
+        Dispatcher(reference).run(600)
+        cpu = machine(SELF_MODIFYING)
+        cache = BlockCache(cpu)
+        self.assertEqual(cache.run(600), 600)
+        self.assertEqual(state(cpu), state(reference))
+        self.assertEqual(cpu.out_history[:3], [1, 2, 3])
+
+    def test_hot_block_is_dispatched(self):
+        cpu = machine(SELF_MODIFYING)
+        cache = BlockCache(cpu)
+        cache.run(600)
+        before = cache.stats()
+        self.assertEqual(cache.dropped[0], HOT_INVALIDATIONS)
+        # Retranslation stops once a start was dropped often enough.
+        cache.run(6000)
+        after = cache.stats()
+        self.assertEqual(after['misses'], before['misses'])
+        self.assertGreater(after['dispatched'], before['dispatched'])
+
+    def test_flush_forgets_hot_blocks(self):
+        cpu = machine(SELF_MODIFYING)
+        cache = BlockCache(cpu)
+        cache.run(600)
+        cache.flush()
+        self.assertFalse(any(cache.dropped))
+        self.assertFalse(any(cache.code))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,163 @@
+import random
+import unittest
+
+from package.compiler import (ARG_INSTRUCTIONS, Compiler, CompilerError,
+                              IncrementalCompiler)
+from package.engine import Dispatcher
+from package.mpu import CPU, PROFILES
+
+WORDS = ['MOVLA', 'MOVLB', 'ADDA', 'OUTA', 'MOVAR', 'JMPL', 'HALT', '05',
+         'F0', 'FF', '#03', '#10', '#-1', 'XX', '']
+
+
+def compiled(lines: list):
+    return Compiler.from_lines(lines).compile()
+
+
+def run(image: list, machine: str, cycles: int = 500):
+    """The final state of image run on machine, with its OUT values."""
+    cpu = CPU.from_profile(machine)
+    cpu.set_instructions(image)
+    cpu.out_history = []
+    cpu.set_enabled(True)
+    Dispatcher(cpu).run(cycles)
+    return (cpu.enable, cpu.reg_a.value, cpu.reg_b.value, cpu.reg_out.value,
+            cpu.carry, cpu.zero, cpu.out_history,
+            list(cpu.ram_mem.memory[0xF0:0xF4]))
+
+
+def program(rnd: random.Random, operand_cells: int):
+    """Random tokens using scratch RAM at F0-F3, labels and jumps to the
+    starts of instructions."""
+    names = [rnd.choice(['MOVLA', 'MOVLB', 'MOVRA', 'MOVAR', 'MOVBR',
+                         'ADDA', 'SUBBA', 'OUTA', 'OUTL', 'JMPL', 'JZFL',
+                         'JCFL', 'HALT'])
+             for _ in range(rnd.randrange(3, 20))]
+    addresses = []
+    labels = {}
+    address = 0
+    for i, name in enumerate(names):
+        if i and rnd.random() < 0.2:
+            address += rnd.randrange(3)
+            labels[i] = address
+        addresses.append(address)
+        address += 1 + (operand_cells if name in ARG_INSTRUCTIONS else 0)
+    tokens = []
+    for i, name in enumerate(names):
+        if i in labels:
+            tokens.append('#%X' % labels[i])
+        tokens.append(name)
+        if name in ('JMPL', 'JZFL', 'JCFL'):
+            tokens.append('%X' % rnd.choice(addresses + [address]))
+        elif name in ('MOVRA', 'MOVAR', 'MOVBR'):
+            tokens.append('%X' % rnd.randrange(0xF0, 0xF4))
+        elif name in ARG_INSTRUCTIONS:
+            tokens.append('%X' % rnd.choice([0, 1, 2, 0xFF]))
+    return tokens
+
+
+class OptimizerTest(unittest.TestCase):
+
+    def test_same_behaviour(self):
+        rnd = random.Random(2)
+        saved = 0
+        for machine, (address_width, data_width) in PROFILES.items():
+            bits = (address_width.value, data_width.value)
+            cells = address_width.value // data_width.value
+            # Images of the wide machines are 64K cells, so fewer of them.
+            for _ in range(150 if bits == (8, 8) else 40):
+                tokens = program(rnd, cells)
+                plain, error = Compiler(tokens, *bits).compile()
+                compiler = Compiler(tokens, *bits, optimize=True)
+                optimized, optimized_error = compiler.compile()
+                self.assertEqual(optimized_error, error)
+                if error != CompilerError.NoError:
+                    continue
+                expected = run(plain, machine)
+                if expected[0]:
+                    continue    # Still running, so not comparable.
+                self.assertEqual(run(optimized, machine), expected,
+                                 " ".join(tokens))
+                saved += compiler.saved_cells
+        self.assertGreater(saved, 0)
+
+    def test_removes_dead_code(self):
+        lines = "MOVLA 01 MOVLA 02 JMPL 06 JMPL 08 OUTA HALT".split()
+        compiler = Compiler(lines, optimize=True)
+        optimized, error = compiler.compile()
+        self.assertEqual(optimized[:4], [0x11, 0x02, 0x03, 0x00])
+        self.assertEqual(compiler.saved_cells, 6)
+        self.assertEqual(run(optimized, 'mpu8'),
+                         run(Compiler(lines).compile()[0], 'mpu8'))
+
+    def test_overlapping_directives(self):
+        # The second # overwrites the HALT at 01 with the operand of MOVLA.
+        lines = "#01 HALT #00 MOVLA 88".split()
+        plain, error = Compiler(lines).compile()
+        self.assertEqual(error, CompilerError.NoError)
+        optimized, error = Compiler(lines, optimize=True).compile()
+        self.assertEqual(error, CompilerError.NoError)
+        self.assertEqual(optimized, plain)
+
+    def test_labels_keep_their_address(self):
+        # Dropping the first MOVLA must not move the code placed at 04.
+        lines = "#00 MOVLA 01 MOVLA 02 #04 OUTA HALT".split()
+        optimized, error = Compiler(lines, optimize=True).compile()
+        self.assertEqual(error, CompilerError.NoError)
+        self.assertEqual(optimized[4:6], [0x03, 0x00])
+        lines = "#00 MOVLA 01 MOVLA 02 JMPL 10 #10 OUTA HALT".split()
+        compiler = Compiler(lines, optimize=True)
+        optimized, error = compiler.compile()
+        self.assertEqual(optimized[:6], [0x11, 0x02, 0x41, 0x10, 0, 0])
+        self.assertEqual(optimized[0x10:0x12], [0x03, 0x00])
+        self.assertEqual(compiler.saved_cells, 2)
+
+
+class IncrementalCompilerTest(unittest.TestCase):
+
+    def test_replace_matches_compiler(self):
+        rnd = random.Random(1)
+
+        def line():
+            return " ".join(rnd.choice(WORDS)
+                            for _ in range(rnd.randrange(4)))
+
+        for _ in range(200):
+            lines = [line() for _ in range(rnd.randrange(10))]
+            assembler = IncrementalCompiler()
+            assembler.update(lines)
+            self.assertEqual(assembler.image(), compiled(lines))
+            for _ in range(10):
+                row = rnd.randrange(len(lines) + 1)
+                count = rnd.randrange(min(2, len(lines) - row) + 1)
+                new = [line() for _ in range(rnd.randrange(3))]
+                lines[row:row + count] = new
+                assembler.replace(row, count, new)
+                self.assertEqual(assembler.texts, lines)
+                self.assertEqual(assembler.image(), compiled(lines))
+
+    def test_update_reassembles_only_the_edit(self):
+        lines = ["MOVLA {0:02X} OUTA".format(i) for i in range(80)]
+        assembler = IncrementalCompiler()
+        assembler.update(lines)
+        assembled = assembler.assembled
+        lines[40] = "MOVLA FF OUTA"
+        assembler.update(lines)
+        self.assertEqual(assembler.assembled, assembled + 1)
+        self.assertEqual(assembler.image(), compiled(lines))
+        # A longer line moves the code after it without assembling it.
+        assembler.replace(40, 1, ["MOVLA FF OUTA OUTA"])
+        self.assertEqual(assembler.assembled, assembled + 2)
+        self.assertEqual(assembler.address(41), 40 * 3 + 4)
+
+    def test_errors_point_at_the_line(self):
+        assembler = IncrementalCompiler()
+        assembler.update(["MOVLA 01", "OUTA XX", "HALT"])
+        self.assertEqual(assembler.error(),
+                         (CompilerError.InstructionError, (2, 6)))
+        assembler.replace(1, 1, ["OUTA"])
+        self.assertEqual(assembler.error(), (CompilerError.NoError, None))
+
+
+if __name__ == '__main__':
+    unittest.main()
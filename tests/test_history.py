@@ -0,0 +1,83 @@
+import unittest
+
+from package.compiler import Compiler
+from package.debug import Debugger
+from package.history import History
+from package.mpu import CPU
+
+# Counts up in RAM and outputs the count, looping forever.
+COUNTER = """
+    MOVRA 0A
+    MOVLB 01
+    ADDA
+    MOVAR 0A
+    OUTA
+    JMPL 00
+"""
+
+
+def machine():
+    image, _ = Compiler(COUNTER.split()).compile()
+    cpu = CPU()
+    cpu.set_instructions(image)
+    cpu.set_enabled(True)
+    return cpu
+
+
+def state(cpu: CPU):
+    return (cpu.pc.value, cpu.reg_a.value, cpu.reg_b.value,
+            cpu.reg_out.value, cpu.carry, cpu.zero, cpu.enable,
+            cpu.ram_mem.dump())
+
+
+class HistoryTest(unittest.TestCase):
+
+    def test_back_restores_every_step(self):
+        cpu = machine()
+        history = History(cpu)
+        states = [state(cpu)]
+        for _ in range(300):
+            history.step()
+            states.append(state(cpu))
+        for count in range(299, -1, -1):
+            self.assertEqual(history.back(), 1)
+            self.assertEqual(history.count, count)
+            self.assertEqual(state(cpu), states[count])
+        self.assertEqual(history.back(), 0)
+
+    def test_back_replays_from_snapshot(self):
+        cpu = machine()
+        history = History(cpu, limit=20000, interval=1024)
+        states = {}
+        for count in range(9000):
+            if count == 6000:
+                states[count] = state(cpu)
+            history.step()
+        self.assertGreater(history.oldest, 6000)
+        self.assertEqual(history.back(3000), 3000)
+        self.assertEqual(history.count, 6000)
+        self.assertEqual(state(cpu), states[6000])
+        # Stepping forward again records from the replayed state.
+        history.step()
+        self.assertEqual(history.back(), 1)
+        self.assertEqual(state(cpu), states[6000])
+
+    def test_replay_ignores_debugger(self):
+        reference = machine()
+        history = History(reference, limit=20000, interval=1024)
+        for _ in range(9000):
+            history.step()
+        history.back(3000)
+        cpu = machine()
+        history = History(cpu, limit=20000, interval=1024)
+        for _ in range(9000):
+            history.step()
+        cpu.debugger = Debugger()
+        cpu.debugger.add('04')
+        self.assertEqual(history.back(3000), 3000)
+        self.assertIsNone(cpu.debugger.hit)
+        self.assertEqual(state(cpu), state(reference))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import os
+import random
+import tempfile
+import unittest
+
+from package.image import DATA, END, record, load_image, save_image
+from package.mpu import CPU, PROFILES
+
+
+def filled(name: str, seed: int):
+    cpu = CPU.from_profile(name)
+    rnd = random.Random(seed)
+    size = len(cpu.ram_mem.memory)
+    # A few scattered blocks, so sparse files have gaps to leave out.
+    for _ in range(8):
+        start = rnd.randrange(size - 40)
+        cpu.ram_mem.load([rnd.randrange(1, cpu.ram_mem.dataMaxValue + 1)
+                          for _ in range(rnd.randrange(1, 40))], start)
+    return cpu.ram_mem
+
+
+class ImageTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def path(self, name: str):
+        return os.path.join(self.directory.name, name)
+
+    def test_round_trip(self):
+        for seed, name in enumerate(sorted(PROFILES)):
+            ram = filled(name, seed)
+            for filename in ('image.hex', 'image.bin'):
+                for sparse in (False, True):
+                    with self.subTest(machine=name, file=filename,
+                                      sparse=sparse):
+                        path = self.path(filename)
+                        save_image(ram, path, sparse)
+                        other = CPU.from_profile(name).ram_mem
+                        other.load([1] * len(other.memory))
+                        load_image(other, path)
+                        self.assertEqual(other.dump(), ram.dump())
+
+    def test_hex_addresses_count_bytes(self):
+        path = self.path('image.hex')
+        with open(path, 'w') as f:
+            f.write(record(DATA, 4, bytes([0x34, 0x12, 0x78, 0x56])) + "\n")
+            f.write(record(END, 0) + "\n")
+        ram = CPU.from_profile('wide16').ram_mem
+        load_image(ram, path)
+        self.assertEqual(list(ram.memory[:4]), [0, 0, 0x1234, 0x5678])
+
+    def test_invalid_address_leaves_ram(self):
+        ram = CPU.from_profile('wide16').ram_mem
+        ram.load([5, 6, 7])
+        path = self.path('image.hex')
+        for address in (1, 0xFFFF):
+            with open(path, 'w') as f:
+                f.write(record(DATA, 0, bytes([9, 0])) + "\n")
+                f.write(record(DATA, address, bytes([1, 2])) + "\n")
+                f.write(record(END, 0) + "\n")
+            with self.assertRaises(RuntimeError):
+                load_image(ram, path)
+            self.assertEqual(list(ram.memory[:4]), [5, 6, 7, 0])
+
+    def test_bad_checksum(self):
+        path = self.path('image.hex')
+        line = record(DATA, 0, b'\x01')
+        with open(path, 'w') as f:
+            f.write(line[:-2] + "00\n")
+        ram = CPU().ram_mem
+        with self.assertRaisesRegex(RuntimeError, "line 1"):
+            load_image(ram, path)
+
+    def test_raw_image_too_large(self):
+        path = self.path('image.bin')
+        with open(path, 'wb') as f:
+            f.write(bytes(257))
+        with self.assertRaises(RuntimeError):
+            load_image(CPU().ram_mem, path)
+
+
+if __name__ == '__main__':
+    unittest.main()